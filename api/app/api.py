@@ -1,27 +1,107 @@
-from sqlalchemy.orm import Session
-from fastapi import Depends, HTTPException
+from fastapi import HTTPException
+import logging
+import os
 import requests
+import time
+from requests.adapters import HTTPAdapter
+from threading import Lock
 from urllib.parse import urljoin
-from app.database import get_db
-from app import crud
+
+log = logging.getLogger(__name__)
+
+# Connections kept open to a bridge
+POOL_SIZE = int(os.getenv('HUE_POOL_SIZE', '10'))
+# Seconds to connect to and to wait for a response of the bridge
+CONNECT_TIMEOUT = float(os.getenv('HUE_CONNECT_TIMEOUT', '3'))
+READ_TIMEOUT = float(os.getenv('HUE_READ_TIMEOUT', '10'))
+# Retries of failed GET requests and the delay before the first one
+RETRIES = 2
+BACKOFF = 0.25
+# Failed requests in a row that open the circuit and the seconds until a
+# request is tried again
+FAILURE_THRESHOLD = 5
+RESET_TIMEOUT = 30
+
+
+class CircuitBreaker:
+    """ Fails fast while the bridge is unreachable. """
+    def __init__(self, threshold=FAILURE_THRESHOLD, reset=RESET_TIMEOUT):
+        self.threshold = threshold
+        self.reset = reset
+        self.failures = 0
+        self.opened = None
+        self._lock = Lock()
+
+    @property
+    def closed(self) -> bool:
+        """ Whether requests are sent to the bridge. """
+        return self.opened is None or (
+            time.monotonic() - self.opened >= self.reset
+        )
+
+    def allow(self) -> bool:
+        """ Whether a request may be sent, a single trial request is
+        allowed after the reset timeout. """
+        with self._lock:
+            if self.opened is None:
+                return True
+            if time.monotonic() - self.opened >= self.reset:
+                self.opened = time.monotonic()
+                return True
+            return False
+
+    def success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened = None
+
+    def failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                if self.opened is None:
+                    log.warning('Hue Bridge unreachable, circuit opened')
+                self.opened = time.monotonic()
 
 
 class ServerSession(requests.Session):
-    """ A requests session with support for a url prefix."""
-    def __init__(self, prefix_url=None, *args, **kwargs):
+    """ A requests session with support for a url prefix, a connection
+    pool, timeouts, retries of GET requests and a circuit breaker. """
+    def __init__(self, prefix_url=None, *args, pool_size=POOL_SIZE,
+                 **kwargs):
         super().__init__(*args, **kwargs)
         self.prefix_url = prefix_url
+        self.breaker = CircuitBreaker()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.mount('http://', adapter)
+        self.mount('https://', adapter)
 
     def request(self, method, url, *args, **kwargs):
         url = urljoin(self.prefix_url, url.lstrip('/'))
-        try:
-            response = super().request(method, url, *args, **kwargs)
-        except requests.ConnectionError as e:
+        kwargs.setdefault('timeout', (CONNECT_TIMEOUT, READ_TIMEOUT))
+
+        if not self.breaker.allow():
             raise HTTPException(
-                status_code=500,
-                detail=e
+                status_code=503,
+                detail='Hue Bridge is unavailable'
             )
 
+        attempts = 1 + (RETRIES if method.upper() == 'GET' else 0)
+        for attempt in range(attempts):
+            try:
+                response = super().request(method, url, *args, **kwargs)
+                break
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt + 1 < attempts:
+                    time.sleep(BACKOFF * 2**attempt)
+                    continue
+                self.breaker.failure()
+                raise HTTPException(
+                    status_code=500,
+                    detail=str(e)
+                )
+        self.breaker.success()
+
         content = response.json()
         try:
             if content[0].get('error'):
@@ -35,25 +115,15 @@ class ServerSession(requests.Session):
         return content
 
 
-hue_session = ServerSession()
-
-
-# Dependecy
-def get_api(
-    db: Session = Depends(get_db)
-):
-    bridge = crud.bridge.get(db)
-
-    if bridge is None:
-        raise HTTPException(
-            status_code=401,
-            detail='Hue Bridge is not configured'
-        )
-
-    return api_from_bridge(bridge)
+_sessions = {}
+_sessions_lock = Lock()
 
 
 def api_from_bridge(bridge):
+    """ Get the session of a bridge, one is kept for every bridge. """
     url = f'http://{bridge.ipaddress}/api/{bridge.username}/'
-    hue_session.prefix_url = url
-    return hue_session
+    with _sessions_lock:
+        session = _sessions.get(url)
+        if session is None:
+            session = _sessions[url] = ServerSession(url)
+        return session
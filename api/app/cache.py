@@ -0,0 +1,191 @@
+"""
+Cache of compiled curves
+"""
+
+from bisect import bisect_right
+from collections import OrderedDict
+from threading import Lock
+import hashlib
+import time
+
+from app.interpolate import monospline
+
+# The x axis of the curves starts at 4am, the lookup tables are indexed by
+# the minute of the day.
+X_SHIFT = 4*60
+MINUTES = 24*60
+
+
+def shape_key(points):
+    """ Content hash of the (x, y) points of a curve. """
+    digest = hashlib.sha1()
+    for x, y in points:
+        digest.update(f'{x}:{y};'.encode())
+    return digest.hexdigest()
+
+
+class CompiledCurve:
+    """ The interpolant of a curve shape and its per minute lookup table. """
+    __slots__ = ('key', 'spline', 'table', '_samples')
+
+    def __init__(self, key, xs, ys):
+        self.key = key
+        self.spline = monospline(xs=xs, ys=ys)
+        self.table = self.spline.evaluate(
+            [minute - X_SHIFT for minute in range(MINUTES)]
+        )
+        self._samples = {}
+
+    def samples(self, step, offset=0):
+        """ Sample the curve across the day every `step` minutes. """
+        key = (step, offset)
+        if key not in self._samples:
+            self._samples[key] = [
+                int(value + offset) for value in
+                self.spline.evaluate(list(range(0, MINUTES + 1, step)))
+            ]
+        return self._samples[key]
+
+
+class Crossings:
+    """ The times of the day a light crosses its on threshold. """
+    __slots__ = ('times', 'states')
+
+    def __init__(self, times, states):
+        self.times = times
+        self.states = states
+
+    def is_on(self, time) -> bool:
+        """ Look up the on state at a time in minutes of the day. """
+        return self.states[bisect_right(self.times, time)]
+
+
+class LRUCache:
+    """
+    Least recently used cache with hit and miss counters.
+    """
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, build):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            self.misses += 1
+
+        value = build()
+        with self._lock:
+            self._entries[key] = value
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def info(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'maxsize': self.maxsize,
+            'currsize': len(self._entries)
+        }
+
+
+class CurveCache(LRUCache):
+    """
+    Cache of compiled curves keyed by the content hash of their points.
+
+    Curves with identical points share one compiled curve, the offset is
+    applied at lookup. The hash of a curve is remembered for its revision,
+    so the points are only loaded again after a change. Revisions are
+    unique, a process that missed the invalidation still notices a change.
+    """
+    def __init__(self, maxsize=128):
+        super().__init__(maxsize)
+        self._shapes = {}
+
+    def get(self, curve) -> CompiledCurve:
+        revision, key = self._shapes.get(curve.id, (None, None))
+        if key is None or revision != curve.revision:
+            key = shape_key((point.x, point.y) for point in curve.points)
+            self._shapes[curve.id] = (curve.revision, key)
+
+        return super().get(key, lambda: CompiledCurve(
+            key=key,
+            xs=[point.x for point in curve.points],
+            ys=[point.y for point in curve.points]
+        ))
+
+    def invalidate(self, curve_id) -> None:
+        """ Forget the shape of a curve. """
+        self._shapes.pop(curve_id, None)
+
+    def clear(self) -> None:
+        super().clear()
+        self._shapes.clear()
+
+
+class SentStates:
+    """
+    The last state each light acknowledged.
+
+    The bridge may apply a different value than requested, e.g. a clamped
+    color temperature. The acknowledged value is remembered next to the
+    requested one, so the same request is not repeated for a light that
+    still shows the acknowledged value.
+    """
+    def __init__(self):
+        self.saved = 0
+        self._states = {}
+        self._lock = Lock()
+
+    def record(self, light_id, body, applied=None) -> None:
+        """ Remember a body and the values the bridge applied. """
+        applied = applied or {}
+        now = time.monotonic()
+        with self._lock:
+            state = self._states.setdefault(light_id, {})
+            for attribute, value in body.items():
+                state[attribute] = (
+                    value, applied.get(attribute, value), now
+                )
+
+    def count_saved(self) -> None:
+        """ Count a request that was not sent, runs count from several
+        threads. """
+        with self._lock:
+            self.saved += 1
+
+    def is_current(self, light_id, attribute, value, hue_state) -> bool:
+        """ Whether the light already shows the value of an attribute. """
+        shown = hue_state.get(attribute)
+        if shown == value:
+            return True
+        requested, applied, _ = self._states.get(light_id, {}).get(
+            attribute, (None, None, None)
+        )
+        return requested == value and shown == applied
+
+    def age(self, light_id, attribute):
+        """ Seconds since an attribute was sent to a light, or None. """
+        _, _, sent = self._states.get(light_id, {}).get(
+            attribute, (None, None, None)
+        )
+        if sent is None:
+            return None
+        return time.monotonic() - sent
+
+
+curves = CurveCache()
+crossings = LRUCache(maxsize=1024)
+plans = LRUCache(maxsize=2)
+sent = SentStates()
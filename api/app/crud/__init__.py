@@ -1,6 +1,7 @@
 from .crud_light import light
 from .crud_group import group
 from .crud_bridge import bridge
+from .crud_cluster import cluster
 from .crud_curve import curve
 from .crud_position import position
 from .crud_settings import settings
@@ -11,6 +12,7 @@ __all__ = [
     'light',
     'group',
     'bridge',
+    'cluster',
     'curve',
     'position',
     'settings',
@@ -32,6 +32,11 @@ class CRUDBase(Generic[ModelType, CreateSchemaType, UpdateSchemaType]):
     ) -> List[ModelType]:
         return db.query(self.model).offset(skip).limit(limit).all()
 
+    def get_all(self, db: Session) -> List[ModelType]:
+        """ Every row ordered by id, for the callers that must not miss
+        one. """
+        return db.query(self.model).order_by(self.model.id).all()
+
     def create(
         self,
         db: Session,
@@ -1,6 +1,6 @@
 from typing import Optional
 from sqlalchemy.orm import Session
-from app.api import ServerSession, api_from_bridge
+from app.api import api_from_bridge
 import logging
 import requests
 import time
@@ -11,6 +11,7 @@ from app.crud.base import CRUDBase
 from app.models import Bridge, Position
 from app.schemas import BridgeCreate, BridgeUpdate, BridgeSync
 
+from .crud_cluster import cluster as crud_cluster
 from .crud_group import group as crud_group
 from .crud_light import light as crud_light
 
@@ -18,8 +19,11 @@ log = logging.getLogger(__name__)
 
 
 class CRUDBridge(CRUDBase[Bridge, BridgeCreate, BridgeUpdate]):
-    def get(self, db: Session) -> Optional[Bridge]:
-        return db.query(self.model).first()
+    def get(self, db: Session, id: str = None) -> Optional[Bridge]:
+        """ Get a bridge, the first one without an id. """
+        if id is None:
+            return db.query(self.model).first()
+        return super().get(db, id=id)
 
     def create(
         self,
@@ -51,35 +55,34 @@ class CRUDBridge(CRUDBase[Bridge, BridgeCreate, BridgeUpdate]):
         ).json()
         log.info('Bridge registered %s', info)
 
-        bridge = self.get(db)
-        new_bridge = Bridge(
-            id=info.get('bridgeid'),
-            name=info.get('name'),
-            ipaddress=info.get('ipaddress'),
-            username=username
-        )
-        db.add(new_bridge)
-        if bridge:
-            db.delete(bridge)
+        # A bridge that is registered again keeps its lights
+        bridge = self.get(db, id=info.get('bridgeid'))
+        if bridge is None:
+            bridge = Bridge(id=info.get('bridgeid'))
+            db.add(bridge)
+        bridge.name = info.get('name')
+        bridge.ipaddress = info.get('ipaddress')
+        bridge.username = username
         db.commit()
 
-        api = api_from_bridge(new_bridge)
-
-        return self.sync(db, api)
-
-    def sync(self, db: Session, api: ServerSession):
+        return self.sync(db, bridge)
 
+    def sync(self, db: Session, bridge: Bridge):
+        """ Sync the lights and groups of a bridge. """
+        api = api_from_bridge(bridge)
         hue_lights = api.get('/lights')
         hue_groups = api.get('/groups')
 
-        lights = {light.id: light for light in crud_light.get_multi(db)}
-        groups = {groups.id: groups for groups in crud_group.get_multi(db)}
+        lights = {light.hue_id: light for light in bridge.lights}
+        groups = {group.hue_id: group for group in bridge.groups}
+        clusters = {cluster.hue_id for cluster in bridge.clusters}
 
         for light_id, hue_light in hue_lights.items():
-            light = lights.get(int(light_id))
+            light = lights.get(light_id)
             if not light:
-                light = crud_light.create(db, obj_in={
-                    'id': int(light_id),
+                lights[light_id] = crud_light.create(db, obj_in={
+                    'bridge_id': bridge.id,
+                    'hue_id': light_id,
                     'position': Position(),
                     'name': hue_light.get('name'),
                     'type': hue_light.get('type'),
@@ -97,41 +100,62 @@ class CRUDBridge(CRUDBase[Bridge, BridgeCreate, BridgeUpdate]):
                     'productname': hue_light.get('productname')
                 })
 
-        for light_id, light in lights.items():
-            if str(light_id) not in hue_lights:
+        for light_id, light in list(lights.items()):
+            if light_id not in hue_lights:
                 crud_light.remove(db, id=light.id)
+                del lights[light_id]
 
+        synced = 0
         for group_id, hue_group in hue_groups.items():
-            group = groups.get(int(group_id))
+            if group_id in clusters:
+                continue
+            synced += 1
+            group = groups.get(group_id)
+            group_lights = [
+                lights[id] for id in hue_group['lights'] if id in lights
+            ]
             if not group:
                 group = crud_group.create(db, obj_in={
-                    'id': int(group_id),
+                    'bridge_id': bridge.id,
+                    'hue_id': group_id,
                     'position': Position(),
                     'name': hue_group.get('name'),
                     'type': hue_group.get('type'),
-                    'lights': (
-                        [crud_light.get(db, id=int(id))
-                            for id in hue_group['lights']]
-                    )}
-                )
+                    'lights': group_lights
+                })
             else:
                 group = crud_group.update(db, db_obj=group, obj_in={
                     'name': hue_group.get('name'),
                     'type': hue_group.get('type'),
-                    'lights': (
-                        [crud_light.get(db, id=int(id))
-                            for id in hue_group['lights']]
-                    )}
-                )
+                    'lights': group_lights
+                })
 
         for group_id, group in groups.items():
-            if str(group_id) not in hue_groups:
+            if group_id not in hue_groups:
                 crud_group.remove(db, id=group.id)
 
+        db.refresh(bridge)
+        crud_cluster.forget_missing(db, bridge, hue_groups)
+
         return {
-            'lights': crud_light.count(db),
-            'groups': crud_group.count(db)
+            'lights': len(hue_lights),
+            'groups': synced,
+            **crud_cluster.sync(db, bridge)
         }
 
+    def sync_all(self, db: Session):
+        """ Sync every bridge, the counts are summed up. An unavailable
+        bridge does not keep the others from being synced. """
+        totals = {'lights': 0, 'groups': 0, 'clusters': 0}
+        for bridge in self.get_all(db):
+            try:
+                counts = self.sync(db, bridge)
+            except HTTPException as e:
+                log.error('syncing %s failed: %s', bridge.name, e.detail)
+                continue
+            for key, count in counts.items():
+                totals[key] += count
+        return totals
+
 
 bridge = CRUDBridge(Bridge)
@@ -0,0 +1,131 @@
+from typing import Dict, List
+from sqlalchemy.orm import Session
+from fastapi import HTTPException
+from app.api import api_from_bridge
+import logging
+import os
+
+from app.crud.base import CRUDBase
+from app.models import Bridge, Cluster, Light
+from app.schemas import ClusterCreate, ClusterUpdate
+
+from .crud_curve import curve as crud_curve
+from .crud_settings import settings as crud_settings
+
+log = logging.getLogger(__name__)
+
+# Maximum number of bridge groups managed by ambientHUE
+POOL_SIZE = int(os.getenv('HUE_GROUP_POOL', '8'))
+
+NAME = 'ambientHUE'
+
+
+class CRUDCluster(CRUDBase[Cluster, ClusterCreate, ClusterUpdate]):
+    def signature(self, light: Light, defaults: Dict[str, int]) -> str:
+        """ Lights with the same signature get the same target state. """
+        return ':'.join(str(value) for value in (
+            light.bri_curve_id or defaults['bri'],
+            light.ct_curve_id or defaults['ct'],
+            float(light.bri_max),
+            float(light.on_threshold),
+            int(light.bri_controlled),
+            int(light.ct_controlled),
+            int(light.on_controlled),
+            int(light.on is not False)
+        ))
+
+    def plan(self, db: Session, bridge: Bridge) -> Dict[str, List[Light]]:
+        """ Find the largest clusters of lights of a bridge with identical
+        schedules, that are not already a group on the bridge. """
+        defaults = {
+            kind: crud_curve.get_default_by_kind(db, kind=kind).id
+            for kind in ('bri', 'ct')
+        }
+        lights = bridge.lights
+
+        clusters = {}
+        for light in lights:
+            clusters.setdefault(
+                self.signature(light, defaults), []
+            ).append(light)
+
+        groups = {frozenset(light.id for light in lights)} | {
+            frozenset(light.id for light in group.lights)
+            for group in bridge.groups
+        }
+        clusters = [
+            (key, members) for key, members in clusters.items()
+            if len(members) >= 2 and (
+                frozenset(light.id for light in members) not in groups
+            )
+        ]
+        clusters.sort(key=lambda cluster: len(cluster[1]), reverse=True)
+        return dict(clusters[:POOL_SIZE])
+
+    def sync(self, db: Session, bridge: Bridge):
+        """ Create, update and delete the groups of the clusters on a
+        bridge after the light config changed. """
+        api = api_from_bridge(bridge)
+        settings = crud_settings.get(db)
+        wanted = self.plan(db, bridge) if settings.dynamic_groups else {}
+
+        # Clusters with the same lights only get the new key, the bridge
+        # is written for changed clusters only
+        existing = {
+            frozenset(light.id for light in cluster.lights): cluster
+            for cluster in bridge.clusters
+        }
+        changed = {}
+        for key, lights in wanted.items():
+            cluster = existing.pop(
+                frozenset(light.id for light in lights), None
+            )
+            if cluster is None:
+                changed[key] = lights
+            else:
+                cluster.key = key
+        unused = list(existing.values())
+
+        for key, lights in changed.items():
+            body = {'lights': [light.hue_id for light in lights]}
+            try:
+                if unused:
+                    cluster = unused.pop()
+                    api.put(f'/groups/{cluster.hue_id}', json=body)
+                    cluster.key = key
+                else:
+                    response = api.post('/groups', json={
+                        'name': f'{NAME} {len(bridge.clusters) + 1}',
+                        'type': 'LightGroup',
+                        **body
+                    })
+                    cluster = Cluster(
+                        bridge=bridge,
+                        hue_id=str(response[0]['success']['id']),
+                        key=key
+                    )
+                    db.add(cluster)
+            except HTTPException as e:
+                log.error('cluster %s: %s', key, e.detail)
+                continue
+            cluster.lights = lights
+
+        for cluster in unused:
+            try:
+                api.delete(f'/groups/{cluster.hue_id}')
+            except HTTPException as e:
+                log.error('cluster %s: %s', cluster.key, e.detail)
+            db.delete(cluster)
+
+        db.commit()
+        return {'clusters': len(wanted)}
+
+    def forget_missing(self, db: Session, bridge: Bridge, hue_groups) -> None:
+        """ Drop the clusters that were deleted on the bridge. """
+        for cluster in list(bridge.clusters):
+            if cluster.hue_id not in hue_groups:
+                db.delete(cluster)
+        db.commit()
+
+
+cluster = CRUDCluster(Cluster)
@@ -1,14 +1,20 @@
-from typing import List, Optional
+from typing import Any, Dict, List, Optional, Tuple, Union
 from sqlalchemy.orm import Session
 from fastapi import HTTPException
 import datetime as dt
-from functools import lru_cache
+import csv
 
 from app.crud.base import CRUDBase
-from app.models import Curve, Point
+from app.models import Curve, Point, new_revision
 from app import schemas
+from app.cache import MINUTES, CompiledCurve, curves as curve_cache
+from app.interpolate import simplify
 
-from app.interpolate import monospline
+# The values the lights accept for each kind of curve
+Y_RANGES = {
+    'bri': (0, 254),
+    'ct': (153, 500)
+}
 
 
 class CRUDCurve(CRUDBase[Curve, schemas.CurveCreate, schemas.CurveUpdate]):
@@ -29,6 +35,29 @@ class CRUDCurve(CRUDBase[Curve, schemas.CurveCreate, schemas.CurveUpdate]):
                   .filter_by(kind=kind)
                   .first())
 
+    def y_range(self, kind: str) -> Tuple[int, int]:
+        """ The range of the values of a kind of curve. """
+        if kind not in Y_RANGES:
+            raise HTTPException(
+                status_code=422,
+                detail=f'Unknown curve kind {kind}'
+            )
+        return Y_RANGES[kind]
+
+    def check_x(self, xs: List[float]) -> None:
+        """ Require strictly increasing x across the whole day, from
+        exactly 0 to exactly 1440. """
+        if len(xs) < 2 or xs[0] != 0 or xs[-1] != MINUTES:
+            raise HTTPException(
+                status_code=422,
+                detail=f'Points must start at x=0 and end at x={MINUTES}'
+            )
+        if any(x >= next_x for x, next_x in zip(xs, xs[1:])):
+            raise HTTPException(
+                status_code=422,
+                detail='The x of the points must be strictly increasing'
+            )
+
     def create(
         self,
         db: Session,
@@ -56,6 +85,81 @@ class CRUDCurve(CRUDBase[Curve, schemas.CurveCreate, schemas.CurveUpdate]):
         db.refresh(curve)
         return curve
 
+    def import_curve(
+        self,
+        db: Session,
+        *,
+        curve_in: schemas.CurveImport
+    ) -> Curve:
+        """ Create a curve from a dense point set, simplified to the
+        tolerance of the import. """
+        if curve_in.csv is not None:
+            samples = self.parse_csv(curve_in.csv)
+        else:
+            samples = [(point.x, point.y) for point in curve_in.points or []]
+
+        y_min, y_max = self.y_range(curve_in.kind)
+        samples = sorted(
+            {round(x): y for x, y in samples}.items()
+        )
+        if len(samples) < 2:
+            raise HTTPException(
+                status_code=422,
+                detail='At least two points with distinct x are required'
+            )
+
+        xs = [x for x, _ in samples]
+        ys = [min(max(y, y_min), y_max) for _, y in samples]
+        self.check_x(xs)
+        keep = simplify(xs, ys, curve_in.tolerance)
+
+        curve = self.model(
+            name=curve_in.name,
+            kind=curve_in.kind,
+            offset=curve_in.offset,
+            default=False
+        )  # type: ignore
+        for index in keep:
+            Point(
+                x=xs[index],
+                y=round(ys[index]),
+                first=index == keep[0],
+                last=index == keep[-1],
+                curve=curve
+            )
+
+        db.add(curve)
+        db.commit()
+        db.refresh(curve)
+        return curve
+
+    def parse_csv(self, content: str) -> List[Tuple[float, float]]:
+        """ Parse x,y rows, a header row is skipped. """
+        samples = []
+        for row_index, row in enumerate(csv.reader(content.splitlines())):
+            if not row:
+                continue
+            try:
+                samples.append((float(row[0]), float(row[1])))
+            except (ValueError, IndexError):
+                if row_index == 0:
+                    continue
+                raise HTTPException(
+                    status_code=422,
+                    detail=f'Invalid CSV row {row_index + 1}'
+                )
+        return samples
+
+    def update(
+        self,
+        db: Session,
+        *,
+        db_obj: Curve,
+        obj_in: Union[schemas.CurveUpdate, Dict[str, Any]]
+    ) -> Curve:
+        self.invalidate(db_obj)
+        return super().update(db, db_obj=db_obj, obj_in=obj_in)
+
     def remove(self, db: Session, *, id: int) -> Curve:
         obj = db.query(self.model).get(id)
         if obj.default:
@@ -63,6 +167,7 @@ class CRUDCurve(CRUDBase[Curve, schemas.CurveCreate, schemas.CurveUpdate]):
                 status_code=422,
                 detail='Default curves are not deletable'
             )
+        self.invalidate(obj)
         db.delete(obj)
         db.commit()
         return obj
@@ -127,6 +232,7 @@ class CRUDCurve(CRUDBase[Curve, schemas.CurveCreate, schemas.CurveUpdate]):
             y=self.calc_value(db, curve, new_x),
             curve=curve
         )
+        self.invalidate(curve)
         db.commit()
         db.refresh(curve)
         return curve
@@ -152,6 +258,7 @@ class CRUDCurve(CRUDBase[Curve, schemas.CurveCreate, schemas.CurveUpdate]):
             )
 
         db.delete(point)
+        self.invalidate(curve)
         db.commit()
         db.refresh(curve)
         return curve
@@ -169,11 +276,80 @@ class CRUDCurve(CRUDBase[Curve, schemas.CurveCreate, schemas.CurveUpdate]):
         point.x = point_in.x
         point.y = point_in.y
 
+        self.invalidate(curve)
+        db.commit()
+        db.refresh(curve)
+        return curve
+
+    def replace_points(
+        self,
+        db: Session,
+        *,
+        curve: Curve,
+        points_in: List[schemas.PointUpdate]
+    ) -> Curve:
+        """ Replace all points of a curve in a single transaction. The
+        points must cover the whole day with values in the range of the
+        curve kind. """
+        self.check_x([point_in.x for point_in in points_in])
+        y_min, y_max = self.y_range(curve.kind)
+        if any(not y_min <= point_in.y <= y_max for point_in in points_in):
+            raise HTTPException(
+                status_code=422,
+                detail=f'The y of the points must be in {y_min}..{y_max}'
+            )
+
+        points = self.get_multiple_points(db, curve=curve)
+        for point in points[len(points_in):]:
+            db.delete(point)
+        for index, point_in in enumerate(points_in):
+            if index < len(points):
+                point = points[index]
+            else:
+                point = Point(curve=curve)
+            point.x = point_in.x
+            point.y = point_in.y
+            point.first = index == 0
+            point.last = index == len(points_in) - 1
+
+        self.invalidate(curve)
         db.commit()
         db.refresh(curve)
         return curve
 
-    @lru_cache()
+    def patch_points(
+        self,
+        db: Session,
+        *,
+        curve: Curve,
+        patches_in: List[schemas.PointPatch]
+    ) -> Curve:
+        """ Change some points of a curve by their index in a single
+        transaction, the other points are kept. """
+        points_in = [
+            schemas.PointUpdate(x=point.x, y=point.y)
+            for point in self.get_multiple_points(db, curve=curve)
+        ]
+        for patch in patches_in:
+            if not 0 <= patch.index < len(points_in):
+                raise HTTPException(
+                    status_code=422,
+                    detail=f'Point {patch.index} not found'
+                )
+            points_in[patch.index] = points_in[patch.index].copy(
+                update=patch.dict(include={'x', 'y'}, exclude_none=True)
+            )
+        return self.replace_points(db, curve=curve, points_in=points_in)
+
+    def invalidate(self, curve: Curve) -> None:
+        """ Bump the revision of a curve after its points or offset
+        changed. """
+        curve.revision = new_revision()
+        curve_cache.invalidate(curve.id)
+
+    def compile(self, curve: Curve) -> CompiledCurve:
+        return curve_cache.get(curve)
+
     def calc_value(
         self,
         db: Session,
@@ -181,25 +357,30 @@ class CRUDCurve(CRUDBase[Curve, schemas.CurveCreate, schemas.CurveUpdate]):
         x: Optional[int] = None
     ) -> int:
         """ Calculate the value from the points"""
-        points = self.get_multiple_points(db, curve=curve)
-
         if x is None:
             now = dt.datetime.now()
-            day_start = now.replace(
-                hour=0,
-                minute=0,
-                second=0,
-                microsecond=0
-            )
-            x = int((now - day_start).total_seconds() / 60) - 4*60
+            return self.value_at(curve, now.hour*60 + now.minute)
 
-        cs = monospline(
-            xs=[point.x for point in points],
-            ys=[point.y + curve.offset for point in points],
-        )
+        return int(self.compile(curve).spline(x) + curve.offset)
+
+    def value_at(self, curve: Curve, minute: int) -> int:
+        """ Look up the value at a minute of the day """
+        table = self.compile(curve).table
+        return int(table[minute % len(table)] + curve.offset)
 
-        value = int(cs(x))
-        return value
+    def get_samples(
+        self,
+        curve: Curve,
+        step: int
+    ) -> schemas.CurveSamples:
+        """ Sample the curve across the day every `step` minutes """
+        return schemas.CurveSamples(
+            id=curve.id,
+            kind=curve.kind,
+            revision=curve.revision,
+            step=step,
+            values=self.compile(curve).samples(step, curve.offset)
+        )
 
     def new_point_location(
         self,
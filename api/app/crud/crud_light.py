@@ -1,22 +1,47 @@
-from typing import Any, Union, Dict, List
+from typing import Any, Union, Dict, List, Optional
 from sqlalchemy.orm import Session
 from sqlalchemy.sql import null
 from app.api import ServerSession
 from fastapi.encoders import jsonable_encoder
 
 from app.crud.base import CRUDBase
-from app.models import Light
+from app.models import Curve, Light
 from app.schemas import LightCreate, LightUpdate
 from .crud_webhook import webhook
 
 
 class CRUDLight(CRUDBase[Light, LightCreate, LightUpdate]):
+    def get_by_hue_id(
+        self,
+        db: Session,
+        bridge_id: str,
+        hue_id: str
+    ) -> Optional[Light]:
+        """ Get a light by its id on a bridge. """
+        return db.query(Light).filter_by(
+            bridge_id=bridge_id, hue_id=str(hue_id)
+        ).first()
+
     def get_multi_controlled(
         self,
         db: Session
     ) -> List[Light]:
         return db.query(Light).filter_by(on_controlled=True).all()
 
+    def get_multi_by_curve(
+        self,
+        db: Session,
+        curve: Curve
+    ) -> List[Light]:
+        """ Get all lights that follow a curve. """
+        lights = curve.bri_lights + curve.ct_lights
+        if curve.default:
+            column = Light.bri_curve_id if curve.kind == 'bri' else (
+                Light.ct_curve_id
+            )
+            lights += db.query(Light).filter(column.is_(None)).all()
+        return lights
+
     def update(
         self,
         db: Session,
@@ -77,10 +102,13 @@ class CRUDLight(CRUDBase[Light, LightCreate, LightUpdate]):
         db: Session,
         api: ServerSession,
         *,
-        light: Light
+        light: Light,
+        hue_state=None
     ) -> Light:
-        hue = api.get(f'/lights/{light.id}')
-        hue_state = hue.get('state')
+        """ Take the Smart Off baseline from the hue state, it is fetched
+        if not known. """
+        if hue_state is None:
+            hue_state = api.get(f'/lights/{light.hue_id}').get('state')
 
         light.smart_off_on = hue_state.get('on', null())
         light.smart_off_bri = hue_state.get('bri', null())
@@ -78,6 +78,8 @@ class CRUDWebhook(CRUDBase[Webhook, WebhookCreate, WebhookUpdate]):
                     params={
                         'item': 'light',
                         'id': light.id,
+                        'hue_id': light.hue_id,
+                        'bridge': light.bridge_id,
                         'name': light.name,
                         'type': light.type,
                         'on': str(light.on).lower()
@@ -91,6 +93,8 @@ class CRUDWebhook(CRUDBase[Webhook, WebhookCreate, WebhookUpdate]):
                     params={
                         'item': 'group',
                         'id': group.id,
+                        'hue_id': group.hue_id,
+                        'bridge': group.bridge_id,
                         'name': group.name,
                         'type': group.type,
                         'on': str(all(
@@ -0,0 +1,402 @@
+"""
+Dispatch of bridge commands
+
+All commands pass a queue in front of their bridge, every bridge has its
+own. A queue paces the traffic with a token bucket, sends at most
+`HUE_CONCURRENCY` requests at the same time and replaces pending commands
+for the same light by newer ones. User initiated commands are sent before
+scheduled ones. Scheduled commands can be delayed to spread them across the
+scheduling interval, the queue holds them until they are due.
+
+The queues live in every process, the scheduled runs dispatch from the
+gunicorn master and the endpoints from the workers. The token buckets are
+kept in shared memory instead, so all processes share the rate of a bridge
+and user initiated commands of a worker go before the scheduled ones of the
+master. This needs the buckets to be allocated before the workers are
+forked, as with `preload_app`. The concurrency is limited per process.
+"""
+
+from collections import OrderedDict
+from fastapi import HTTPException
+from threading import Condition, Event, Lock, Thread
+import logging
+import multiprocessing
+import os
+import time
+import zlib
+
+log = logging.getLogger(__name__)
+
+# Maximum number of concurrent requests to the bridge
+CONCURRENCY = int(os.getenv('HUE_CONCURRENCY', '4'))
+# Sustained commands per second and burst size of the token bucket
+RATE = float(os.getenv('HUE_RATE', '10'))
+BURST = int(os.getenv('HUE_BURST', '10'))
+# Seconds to wait for the result of a command after it was queued
+WAIT_TIMEOUT = 30
+# Bridges whose token buckets are shared between the processes
+MAX_BRIDGES = int(os.getenv('HUE_MAX_BRIDGES', '8'))
+
+
+class Command:
+    """ A state change for a light or a group of lights. """
+    __slots__ = (
+        'api', 'lights', 'path', 'body', 'delay', 'response', 'error',
+        'sent', 'latency', 'done', 'parts'
+    )
+
+    def __init__(self, api, path, body, lights, delay=0):
+        # The session of the bridge of the lights
+        self.api = api
+        self.lights = lights
+        self.path = path
+        self.body = body
+        # Seconds after the start of the dispatch the command is due
+        self.delay = delay
+        self.response = None
+        self.error = None
+        self.sent = None
+        self.latency = None
+        self.done = Event()
+        # The requests the command is sent with, a group action that was
+        # split up is sent for each of its lights
+        self.parts = 1
+
+
+def acknowledged(response):
+    """ The values the bridge applied according to its response. """
+    applied = {}
+    for item in response or []:
+        success = item.get('success') if isinstance(item, dict) else None
+        if isinstance(success, dict):
+            for path, value in success.items():
+                applied[str(path).rsplit('/', 1)[-1]] = value
+    return applied
+
+
+def merge(older, newer):
+    """ The body of two commands for the same target, the values of the
+    newer one win. Switching off and the transition time only apply to
+    the values they were sent with. """
+    if newer.get('on') is False:
+        return dict(newer)
+    body = {
+        key: value for key, value in older.items()
+        if key != 'transitiontime'
+    }
+    body.update(newer)
+    return body
+
+
+def light_command(api, light, body) -> Command:
+    return Command(api, f'/lights/{light.hue_id}/state', body, [light])
+
+
+def group_command(api, group_id, lights, body) -> Command:
+    return Command(api, f'/groups/{group_id}/action', body, lights)
+
+
+class Report:
+    """ The results of a dispatch. """
+    def __init__(self, commands, latency, start=None):
+        self.commands = commands
+        self.latency = latency
+        self.start = start
+
+    @property
+    def errors(self):
+        return [command for command in self.commands if command.error]
+
+    @property
+    def pending(self):
+        """ The commands that were not sent within the wait timeout. """
+        return [
+            command for command in self.commands
+            if not command.done.is_set()
+        ]
+
+    @property
+    def timings(self):
+        """ Offset of the send and latency of every command, in
+        seconds. """
+        return [
+            (command.sent - self.start, command.latency)
+            for command in self.commands
+            if command.sent is not None and self.start is not None
+        ]
+
+    def __str__(self):
+        text = (f'{len(self.commands)} commands, {len(self.errors)} errors '
+                f'in {self.latency:.3f}s')
+        timings = self.timings
+        if timings:
+            latencies = [latency for _, latency in timings]
+            text += (
+                f', sent within {max(sent for sent, _ in timings):.3f}s, '
+                f'latency mean {sum(latencies)/len(latencies):.3f}s '
+                f'max {max(latencies):.3f}s'
+            )
+        return text
+
+
+class TokenBucket:
+    """ Allows `rate` operations per second with bursts of `burst`.
+
+    The state holds the tokens, the time of the last update and the time
+    until which operations with priority go first. It may be an array in
+    shared memory with a lock of `multiprocessing`.
+    """
+    def __init__(self, rate, burst, state=None, lock=None):
+        self.rate = rate
+        self.burst = burst
+        self._state = state or [burst, time.monotonic(), 0]
+        self._lock = lock or Lock()
+
+    def acquire(self, priority=False):
+        if self.rate <= 0:
+            return
+        state = self._state
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                state[0] = min(
+                    self.burst, state[0] + (now - state[1]) * self.rate
+                )
+                state[1] = now
+                if priority:
+                    # Others wait while an operation with priority waits,
+                    # an abandoned claim expires by itself
+                    state[2] = now + 2 / self.rate
+                if state[0] >= 1 and (priority or now >= state[2]):
+                    state[0] -= 1
+                    return
+                wait = max(1 - state[0], 0.5) / self.rate
+            time.sleep(wait)
+
+    def release(self):
+        """ Return an unused token. """
+        with self._lock:
+            self._state[0] = min(self.burst, self._state[0] + 1)
+
+
+class SharedBuckets:
+    """ Token buckets in shared memory, one for every bridge. The slots are
+    allocated on creation, before the workers are forked, and claimed by
+    the bridges on first use. """
+    def __init__(self, slots=MAX_BRIDGES):
+        self._lock = multiprocessing.Lock()
+        self._keys = multiprocessing.RawArray('q', slots)
+        self._slots = [
+            (multiprocessing.RawArray('d', 3), multiprocessing.Lock())
+            for _ in range(slots)
+        ]
+
+    def get(self, url, rate=RATE, burst=BURST) -> TokenBucket:
+        """ The bucket of a bridge, a bucket of this process if all slots
+        are taken. """
+        key = zlib.crc32(url.encode()) + 1
+        with self._lock:
+            for index, slot_key in enumerate(self._keys):
+                if slot_key in (key, 0):
+                    break
+            else:
+                log.warning('no shared rate limit for %s', url)
+                return TokenBucket(rate, burst)
+            state, lock = self._slots[index]
+            if slot_key == 0:
+                self._keys[index] = key
+                state[0], state[1], state[2] = burst, time.monotonic(), 0
+        return TokenBucket(rate, burst, state, lock)
+
+
+class _Pending:
+    """ A queued request and the commands waiting for it. """
+    __slots__ = ('api', 'body', 'commands', 'due')
+
+    def __init__(self, api, body, commands, due):
+        self.api = api
+        self.body = body
+        self.commands = commands
+        # The monotonic time the request may be sent from
+        self.due = due
+
+
+class CommandQueue:
+    def __init__(
+        self, rate=RATE, burst=BURST, concurrency=CONCURRENCY, bucket=None
+    ):
+        self.bucket = bucket or TokenBucket(rate, burst)
+        self.concurrency = max(1, concurrency)
+        self.coalesced = 0
+        # The priority lane and the scheduled lane
+        self._lanes = (OrderedDict(), OrderedDict())
+        self._condition = Condition()
+        self._threads = []
+        self._pid = None
+
+    def submit(self, command: Command, priority=False, due=None):
+        """ Queue a command to be sent from the monotonic time `due` on,
+        it is merged into a pending command for the same light or group.
+        Commands with `priority` are due at once. """
+        api = command.api
+        now = time.monotonic()
+        due = now if priority or due is None else due
+        with self._condition:
+            self._start()
+            if priority and command.path.startswith('/lights/'):
+                self._split(command.lights)
+            urgent, scheduled = self._lanes
+            entry = urgent.get(command.path) or scheduled.get(command.path)
+            if entry is None:
+                lane = urgent if priority else scheduled
+                lane[command.path] = _Pending(
+                    api, command.body, [command], due
+                )
+            else:
+                self.coalesced += 1
+                entry.api = api
+                entry.body = merge(entry.body, command.body)
+                entry.commands.append(command)
+                entry.due = min(entry.due, due)
+                if priority and command.path in scheduled:
+                    urgent[command.path] = scheduled.pop(command.path)
+            self._condition.notify_all()
+
+    def _split(self, lights):
+        """ Break the pending group actions that cover one of the lights up
+        into requests for each of their lights. The newer command for a
+        light is merged into its request and cannot be overtaken by the
+        older group action. """
+        hue_ids = {light.hue_id for light in lights}
+        for lane in self._lanes:
+            for path, entry in list(lane.items()):
+                if not path.startswith('/groups/'):
+                    continue
+                members = {
+                    light.hue_id for command in entry.commands
+                    for light in command.lights
+                }
+                if not hue_ids & members:
+                    continue
+                del lane[path]
+                for command in entry.commands:
+                    command.parts += len(members) - 1
+                for hue_id in sorted(members):
+                    light_path = f'/lights/{hue_id}/state'
+                    pending = (
+                        self._lanes[0].get(light_path)
+                        or self._lanes[1].get(light_path)
+                    )
+                    if pending is None:
+                        lane[light_path] = _Pending(
+                            entry.api, dict(entry.body),
+                            list(entry.commands), entry.due
+                        )
+                    else:
+                        pending.body = merge(entry.body, pending.body)
+                        pending.commands.extend(entry.commands)
+                        pending.due = min(pending.due, entry.due)
+
+    def _start(self):
+        """ Start the workers, once in every process. """
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._threads = [
+            Thread(target=self._work, daemon=True, name=f'hue-{index}')
+            for index in range(self.concurrency)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def _next(self):
+        """ The lane and path of the first due request, otherwise None
+        and the seconds until the next one is due. """
+        now = time.monotonic()
+        wait = None
+        for lane in self._lanes:
+            for path, entry in lane.items():
+                if entry.due <= now:
+                    return lane, path, 0
+                if wait is None or entry.due - now < wait:
+                    wait = entry.due - now
+        return None, None, wait
+
+    def _work(self):
+        while True:
+            with self._condition:
+                lane, _, wait = self._next()
+                while lane is None:
+                    self._condition.wait(wait)
+                    lane, _, wait = self._next()
+            self.bucket.acquire(priority=lane is self._lanes[0])
+            with self._condition:
+                lane, path, _ = self._next()
+                if lane is None:
+                    self.bucket.release()
+                    continue
+                entry = lane.pop(path)
+            self._send(path, entry)
+
+    def _send(self, path, entry: _Pending):
+        start = time.monotonic()
+        response = error = None
+        try:
+            response = entry.api.put(path, json=entry.body)
+        except HTTPException as e:
+            error = e.detail
+        except Exception as e:
+            log.exception('%s failed', path)
+            error = str(e)
+        latency = time.monotonic() - start
+
+        for command in entry.commands:
+            with self._condition:
+                command.parts -= 1
+                finished = command.parts <= 0
+            if command.path == path:
+                command.body = entry.body
+            command.response = response
+            command.error = command.error or error
+            command.sent = start
+            command.latency = latency
+            if finished:
+                command.done.set()
+
+
+_queues = {}
+_queues_lock = Lock()
+_buckets = SharedBuckets()
+
+
+def queue_for(api) -> CommandQueue:
+    """ The queue of a bridge, one is kept for every bridge. """
+    with _queues_lock:
+        queue = _queues.get(api.prefix_url)
+        if queue is None:
+            queue = _queues[api.prefix_url] = CommandQueue(
+                bucket=_buckets.get(api.prefix_url)
+            )
+        return queue
+
+
+def dispatch(commands, priority=False) -> Report:
+    """ Send the commands to their bridges and wait for the results, the
+    bridges are served at the same time. """
+    start = time.monotonic()
+    for command in commands:
+        queue_for(command.api).submit(
+            command, priority=priority, due=start + command.delay
+        )
+    for command in commands:
+        command.done.wait(max(
+            0, start + command.delay + WAIT_TIMEOUT - time.monotonic()
+        ))
+
+    report = Report(commands, time.monotonic() - start, start)
+    for command in report.errors:
+        log.error('%s failed: %s', command.path, command.error)
+    for command in report.pending:
+        log.warning('%s is still queued', command.path)
+    log.debug('dispatched %s', report)
+    return report
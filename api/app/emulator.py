@@ -0,0 +1,158 @@
+"""
+Local stand-in for a Hue bridge
+
+Serves the light and group endpoints of the v1 API and the v2 event stream
+for a set of emulated lights, so the live states can be tested offline:
+
+    python -m app.emulator --port 8000 --lights 5
+
+Register a bridge with the ipaddress `127.0.0.1:8000` and the username
+`emulator`, and set `HUE_EVENTS_URL=http://{ipaddress}/eventstream/clip/v2`.
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from queue import Queue
+from threading import Lock
+import argparse
+import json
+import uuid
+
+USERNAME = 'emulator'
+
+
+class Bridge:
+    """ The lights of the emulator and the subscribers to its events. """
+    def __init__(self, count=3):
+        self.lights = {
+            str(index): {
+                'state': {
+                    'on': False, 'bri': 254, 'ct': 366,
+                    'colormode': 'ct', 'reachable': True
+                },
+                'type': 'Color temperature light',
+                'name': f'Light {index}',
+                'modelid': 'LTW001',
+                'manufacturername': 'Signify Netherlands B.V.',
+                'productname': 'Hue ambiance lamp'
+            }
+            for index in range(1, count + 1)
+        }
+        self.groups = {}
+        self.subscribers = []
+        self._lock = Lock()
+
+    def set_state(self, light_id, state):
+        """ Change a light and publish the change. """
+        with self._lock:
+            self.lights[light_id]['state'].update(state)
+        self.publish(light_id, state)
+        return [
+            {'success': {f'/lights/{light_id}/state/{key}': value}}
+            for key, value in state.items()
+        ]
+
+    def publish(self, light_id, state):
+        data = {'id': str(uuid.uuid4()), 'id_v1': f'/lights/{light_id}',
+                'type': 'light'}
+        if 'on' in state:
+            data['on'] = {'on': state['on']}
+        if 'bri' in state:
+            data['dimming'] = {'brightness': round(state['bri'] / 2.54, 2)}
+        if 'ct' in state:
+            data['color_temperature'] = {'mirek': state['ct']}
+        event = [{'id': str(uuid.uuid4()), 'type': 'update', 'data': [data]}]
+        for subscriber in list(self.subscribers):
+            subscriber.put(event)
+
+
+class Handler(BaseHTTPRequestHandler):
+    bridge: Bridge = None
+
+    def do_GET(self):
+        parts = self.path.strip('/').split('/')
+        if parts == ['eventstream', 'clip', 'v2']:
+            return self.stream()
+        if parts[:1] != ['api']:
+            return self.send_error(404)
+        if parts[:2] != ['api', USERNAME]:
+            return self.reply([{'error': {'description': 'unauthorized'}}])
+        parts = parts[2:]
+        if parts == ['lights']:
+            return self.reply(self.bridge.lights)
+        if parts == ['groups']:
+            return self.reply(self.bridge.groups)
+        if len(parts) == 2 and parts[0] == 'lights':
+            return self.reply(self.bridge.lights.get(parts[1], {}))
+        if parts == ['groups', '0']:
+            return self.reply(
+                {'name': 'Group 0', 'lights': list(self.bridge.lights)}
+            )
+        if len(parts) == 2 and parts[0] == 'groups':
+            return self.reply(self.bridge.groups.get(parts[1], {}))
+        self.send_error(404)
+
+    def do_PUT(self):
+        parts = self.path.strip('/').split('/')[2:]
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}')
+        body.pop('transitiontime', None)
+        if len(parts) == 3 and parts[0] == 'lights':
+            return self.reply(self.bridge.set_state(parts[1], body))
+        if len(parts) == 3 and parts[0] == 'groups':
+            if parts[1] == '0':
+                light_ids = list(self.bridge.lights)
+            else:
+                light_ids = self.bridge.groups[parts[1]]['lights']
+            for light_id in light_ids:
+                self.bridge.set_state(light_id, body)
+            return self.reply([
+                {'success': {f'/groups/{parts[1]}/action/{key}': value}}
+                for key, value in body.items()
+            ])
+        self.send_error(404)
+
+    def reply(self, content):
+        data = json.dumps(content).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def stream(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.end_headers()
+        events = Queue()
+        self.bridge.subscribers.append(events)
+        try:
+            self.wfile.write(b': hi\n\n')
+            self.wfile.flush()
+            while True:
+                event = events.get()
+                self.wfile.write(
+                    f'id: {uuid.uuid4()}\ndata: {json.dumps(event)}\n\n'
+                    .encode()
+                )
+                self.wfile.flush()
+        except OSError:
+            pass
+        finally:
+            self.bridge.subscribers.remove(events)
+
+
+def serve(port=8000, count=3):
+    """ Create an emulated bridge, its lights are `server.bridge`. """
+    bridge = Bridge(count)
+    handler = type('BridgeHandler', (Handler,), {'bridge': bridge})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.bridge = bridge
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--lights', type=int, default=3)
+    args = parser.parse_args()
+    serve(args.port, args.lights).serve_forever()
@@ -7,6 +7,7 @@ from app.endpoints import light
 from app.endpoints import group
 from app.endpoints import webhook
 from app.endpoints import settings
+from app.endpoints import plan
 
 __all__ = [
     curve,
@@ -16,5 +17,6 @@ __all__ = [
     light,
     group,
     webhook,
-    settings
+    settings,
+    plan
 ]
@@ -1,9 +1,9 @@
 from typing import Any, List
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
-from app import schemas, crud
+from app import schemas, crud, events, offload
 from app.database import get_db
-from app.api import get_api, ServerSession
+from app.schedules import wake
 import requests
 import logging
 
@@ -19,8 +19,15 @@ async def get_bridge(
     return crud.bridge.get(db)
 
 
+@router.get('/all', response_model=List[schemas.Bridge])
+async def get_all_bridges(
+    db: Session = Depends(get_db)
+) -> Any:
+    return crud.bridge.get_all(db)
+
+
 @router.post('/', response_model=schemas.BridgeSync)
-async def create_bridge(
+def create_bridge(
     bridge_in: schemas.BridgeCreate,
     db: Session = Depends(get_db),
 ) -> Any:
@@ -28,13 +35,30 @@ async def create_bridge(
 
 
 @router.get('/discover', response_model=List[schemas.BridgeDiscovery])
-async def discover_bridges() -> Any:
+def discover_bridges() -> Any:
     return requests.get('https://discovery.meethue.com/').json()
 
 
 @router.get('/sync', response_model=schemas.BridgeSync)
-async def sync_with_bridge(
-    db: Session = Depends(get_db),
-    api: ServerSession = Depends(get_api)
+def sync_with_bridge(
+    db: Session = Depends(get_db)
+) -> Any:
+    return crud.bridge.sync_all(db)
+
+
+@router.delete('/{id}', response_model=schemas.Bridge)
+def delete_bridge(
+    id: str,
+    db: Session = Depends(get_db)
 ) -> Any:
-    return crud.bridge.sync(db, api)
+    bridge = crud.bridge.get(db, id=id)
+    if bridge is None:
+        raise HTTPException(
+            status_code=404,
+            detail='Bridge not found'
+        )
+    offload.forget(db, bridge)
+    bridge = crud.bridge.remove(db, id=id)
+    events.states.forget(id)
+    wake(db)
+    return bridge
@@ -1,10 +1,9 @@
 from typing import Any, List
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
 from app import schemas, crud
 from app.database import get_db
-from app.schedules import run
-from app.api import get_api, ServerSession
+from app.schedules import get_affected_lights, run, wake
 
 router = APIRouter()
 
@@ -17,7 +16,7 @@ async def get_all_curves(
     if kind:
         curves = crud.curve.get_multi_by_kind(db, kind=kind)
     else:
-        curves = crud.curve.get_multi(db)
+        curves = crud.curve.get_all(db)
     return curves
 
 
@@ -29,6 +28,27 @@ async def create_curve(
     return crud.curve.create(db, curve_in=curve_in)
 
 
+@router.post('/import', response_model=schemas.Curve)
+async def import_curve(
+    curve_in: schemas.CurveImport,
+    db: Session = Depends(get_db)
+) -> Any:
+    return crud.curve.import_curve(db, curve_in=curve_in)
+
+
+@router.get('/samples', response_model=List[schemas.CurveSamples])
+async def get_all_curve_samples(
+    kind: str = None,
+    step: int = Query(5, ge=1, le=1440),
+    db: Session = Depends(get_db)
+) -> Any:
+    if kind:
+        curves = crud.curve.get_multi_by_kind(db, kind=kind)
+    else:
+        curves = crud.curve.get_all(db)
+    return [crud.curve.get_samples(curve, step=step) for curve in curves]
+
+
 @router.get('/{id}', response_model=schemas.Curve)
 async def get_curve(
     id: int,
@@ -37,37 +57,95 @@ async def get_curve(
     return crud.curve.get(db, id=id)
 
 
+@router.get('/{id}/samples', response_model=schemas.CurveSamples)
+async def get_curve_samples(
+    id: int,
+    step: int = Query(5, ge=1, le=1440),
+    db: Session = Depends(get_db)
+) -> Any:
+    curve = crud.curve.get(db, id=id)
+    if curve is None:
+        raise HTTPException(
+            status_code=404,
+            detail='Curve not found'
+        )
+    return crud.curve.get_samples(curve, step=step)
+
+
 @router.put('/{id}', response_model=schemas.Curve)
-async def update_curve(
+def update_curve(
     id: int,
     curve_in: schemas.CurveUpdate,
-    db: Session = Depends(get_db),
-    api: ServerSession = Depends(get_api)
+    db: Session = Depends(get_db)
 ) -> Any:
     curve = crud.curve.get(db, id=id)
     curve = crud.curve.update(db, db_obj=curve, obj_in=curve_in)
-    run(disable=True, db=db, api=api)
+    run(disable=True, db=db, curves=[curve], priority=True)
+    wake(db)
     return curve
 
 
 @router.delete('/{id}', response_model=schemas.Curve)
-async def delete_curve(
+def delete_curve(
     id: int,
-    db: Session = Depends(get_db),
-    api: ServerSession = Depends(get_api)
+    db: Session = Depends(get_db)
 ) -> Any:
+    curve = crud.curve.get(db, id=id)
+    lights = get_affected_lights(db, [curve])
     curve = crud.curve.remove(db, id=id)
-    run(disable=True, db=db, api=api)
+    run(
+        disable=True,
+        lights=lights,
+        db=db,
+        curves=[curve],
+        priority=True
+    )
+    wake(db)
+    return curve
+
+
+@router.put('/{id}/points', response_model=schemas.Curve)
+def replace_points(
+    id: int,
+    points_in: List[schemas.PointUpdate],
+    db: Session = Depends(get_db)
+) -> Any:
+    curve = crud.curve.get(db, id=id)
+    if curve is None:
+        raise HTTPException(
+            status_code=404,
+            detail='Curve not found'
+        )
+    curve = crud.curve.replace_points(db, curve=curve, points_in=points_in)
+    run(disable=True, db=db, curves=[curve], priority=True)
+    wake(db)
+    return curve
+
+
+@router.patch('/{id}/points', response_model=schemas.Curve)
+def patch_points(
+    id: int,
+    patches_in: List[schemas.PointPatch],
+    db: Session = Depends(get_db)
+) -> Any:
+    curve = crud.curve.get(db, id=id)
+    if curve is None:
+        raise HTTPException(
+            status_code=404,
+            detail='Curve not found'
+        )
+    curve = crud.curve.patch_points(db, curve=curve, patches_in=patches_in)
+    run(disable=True, db=db, curves=[curve], priority=True)
+    wake(db)
     return curve
 
 
 @router.post('/{id}/{point_index}', response_model=schemas.Curve)
-async def insert_point(
+def insert_point(
     id: int,
     point_index: int,
     point_in: schemas.PointCreate,
-    db: Session = Depends(get_db),
-    api: ServerSession = Depends(get_api)
+    db: Session = Depends(get_db)
 ) -> Any:
     curve = crud.curve.get(db, id=id)
     curve = crud.curve.create_point(
@@ -76,30 +154,30 @@ async def insert_point(
         point_index=point_index,
         point_in=point_in
     )
-    run(disable=True, db=db, api=api)
+    run(disable=True, db=db, curves=[curve], priority=True)
+    wake(db)
     return curve
 
 
 @router.delete('/{id}/{point_index}', response_model=schemas.Curve)
-async def delete_point(
+def delete_point(
     id: int,
     point_index: int,
-    db: Session = Depends(get_db),
-    api: ServerSession = Depends(get_api)
+    db: Session = Depends(get_db)
 ) -> Any:
     curve = crud.curve.get(db, id=id)
     curve = crud.curve.delete_point(db, curve=curve, index=point_index)
-    run(disable=True, db=db, api=api)
+    run(disable=True, db=db, curves=[curve], priority=True)
+    wake(db)
     return curve
 
 
 @router.put('/{id}/{point_index}', response_model=schemas.Curve)
-async def update_point(
+def update_point(
     id: int,
     point_index: int,
     point_in: schemas.PointUpdate,
-    db: Session = Depends(get_db),
-    api: ServerSession = Depends(get_api)
+    db: Session = Depends(get_db)
 ) -> Any:
     curve = crud.curve.get(db, id=id)
     curve = crud.curve.update_point(
@@ -108,5 +186,6 @@ async def update_point(
         index=point_index,
         point_in=point_in
     )
-    run(disable=True, db=db, api=api)
+    run(disable=True, db=db, curves=[curve], priority=True)
+    wake(db)
     return curve
@@ -1,10 +1,10 @@
 from typing import Any, List
 from fastapi import APIRouter, Depends
 from sqlalchemy.orm import Session
-from app.api import get_api, ServerSession
+from app.api import api_from_bridge
 from app import schemas, crud
 from app.database import get_db
-from app.schedules import run
+from app.schedules import run, wake
 
 router = APIRouter()
 
@@ -13,7 +13,7 @@ router = APIRouter()
 async def get_all_groups(
     db: Session = Depends(get_db)
 ) -> Any:
-    return crud.group.get_multi(db)
+    return crud.group.get_all(db)
 
 
 @router.get('/{id}', response_model=schemas.Group)
@@ -25,13 +25,13 @@ async def get_group(
 
 
 @router.put('/{id}', response_model=schemas.Group)
-async def update_group(
+def update_group(
     id: int,
     light_in: schemas.LightUpdate,
-    db: Session = Depends(get_db),
-    api: ServerSession = Depends(get_api)
+    db: Session = Depends(get_db)
 ) -> Any:
     group = crud.group.get(db, id=id)
+    api = api_from_bridge(group.bridge)
 
     for light in group.lights:
         crud.light.update(db, api,  light=light, light_in=light_in)
@@ -39,6 +39,8 @@ async def update_group(
     if light_in.on is not None:
         crud.webhook.fire(group=group)
 
-    run(disable=True, lights=group.lights, db=db, api=api)
+    crud.cluster.sync(db, group.bridge)
+    run(disable=True, lights=group.lights, db=db, priority=True)
+    wake(db)
     db.commit()
     return group
@@ -3,8 +3,8 @@ from fastapi import APIRouter, Depends
 from sqlalchemy.orm import Session
 from app import schemas, crud
 from app.database import get_db
-from app.api import get_api, ServerSession
-from app.schedules import run
+from app.api import api_from_bridge
+from app.schedules import run, wake
 
 router = APIRouter()
 
@@ -13,7 +13,7 @@ router = APIRouter()
 async def get_all_lights(
     db: Session = Depends(get_db)
 ) -> Any:
-    return crud.light.get_multi(db)
+    return crud.light.get_all(db)
 
 
 @router.get('/{id}', response_model=schemas.Light)
@@ -25,15 +25,18 @@ async def get_light(
 
 
 @router.put('/{id}', response_model=schemas.Light)
-async def update_light(
+def update_light(
     id: int,
     light_in: schemas.LightUpdate,
     db: Session = Depends(get_db),
-    api: ServerSession = Depends(get_api),
 ) -> Any:
     light = crud.light.get(db, id=id)
-    light = crud.light.update(db, api, light=light, light_in=light_in)
-    run(disable=True, lights=[light], db=db, api=api)
+    light = crud.light.update(
+        db, api_from_bridge(light.bridge), light=light, light_in=light_in
+    )
+    crud.cluster.sync(db, light.bridge)
+    run(disable=True, lights=[light], db=db, priority=True)
+    wake(db)
     db.add(light)
     db.commit()
     db.refresh(light)
@@ -0,0 +1,49 @@
+from typing import Any
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+from app import schemas
+from app.database import get_db
+from app.plan import UNSET
+from app.schedules import get_plan
+
+router = APIRouter()
+
+
+@router.get('/', response_model=schemas.Plan)
+async def get_day_plan(
+    db: Session = Depends(get_db)
+) -> Any:
+    day_plan = get_plan(db)
+    return schemas.Plan(
+        commands=day_plan.commands(),
+        lights=[
+            schemas.LightPlan(id=light_id, commands=light_plan.commands())
+            for light_id, light_plan in day_plan.lights.items()
+        ]
+    )
+
+
+@router.get('/{id}', response_model=schemas.LightPlan)
+async def get_light_plan(
+    id: int,
+    db: Session = Depends(get_db)
+) -> Any:
+    light_plan = get_plan(db).lights.get(id)
+    if light_plan is None:
+        raise HTTPException(
+            status_code=404,
+            detail='Light not found'
+        )
+    return schemas.LightPlan(
+        id=id,
+        commands=light_plan.commands(),
+        events=[
+            schemas.PlanEvent(
+                time=time,
+                bri=None if bri == UNSET else bri,
+                ct=None if ct == UNSET else ct,
+                on=None if on == UNSET else bool(on)
+            )
+            for time, bri, ct, on in light_plan.events()
+        ]
+    )
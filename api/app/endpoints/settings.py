@@ -1,9 +1,10 @@
 from typing import Any
 from fastapi import APIRouter, Depends
 from sqlalchemy.orm import Session
-from app import schemas, crud
+from app import schemas, crud, offload
 from app.database import get_db
-from app.api import ServerSession, get_api
+from app.api import api_from_bridge
+from app.schedules import wake
 
 router = APIRouter()
 
@@ -14,17 +15,26 @@ async def get_status(db: Session = Depends(get_db)) -> Any:
 
 
 @router.put("/", response_model=schemas.Settings)
-async def update_status(
+def update_status(
     settings_in: schemas.SettingsUpdate,
     db: Session = Depends(get_db),
-    api: ServerSession = Depends(get_api),
 ) -> Any:
     settings = crud.settings.get(db)
+    offloaded = settings.bridge_schedules
     settings = crud.settings.update(db, db_obj=settings, obj_in=settings_in)
 
-    if settings_in.smart_off is False:
-        lights = crud.light.get_multi(db)
-        for light in lights:
-            crud.light.reset_smart_off(db, api, light=light)
+    if offloaded and not settings.bridge_schedules:
+        offload.withdraw(db)
+    for bridge in crud.bridge.get_all(db):
+        if settings_in.smart_off is False:
+            api = api_from_bridge(bridge)
+            hue_lights = api.get('/lights')
+            for light in bridge.lights:
+                crud.light.reset_smart_off(
+                    db, api, light=light,
+                    hue_state=hue_lights.get(light.hue_id, {}).get('state')
+                )
 
+        crud.cluster.sync(db, bridge)
+    wake(db)
     return settings
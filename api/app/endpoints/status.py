@@ -1,10 +1,9 @@
 from typing import Any
 from fastapi import APIRouter, Depends
 from sqlalchemy.orm import Session
-from app import schemas, crud
+from app import schemas, crud, offload
 from app.database import get_db
-from app.schedules import run
-from app.api import get_api, ServerSession
+from app.schedules import run, wake
 import logging
 
 log = logging.getLogger(__name__)
@@ -18,14 +17,20 @@ async def get_status(db: Session = Depends(get_db)) -> Any:
 
 
 @router.put("/", response_model=schemas.Status)
-async def update_status(
+def update_status(
     status_in: schemas.StatusCreate,
-    db: Session = Depends(get_db),
-    api: ServerSession = Depends(get_api)
+    db: Session = Depends(get_db)
 ) -> Any:
     status = crud.status.get(db)
+    enabled = status.status
     status = crud.status.update(db, db_obj=status, obj_in=status_in)
 
-    run(disable=True, db=db, api=api)
+    if (
+        enabled and not status.status
+        and crud.settings.get(db).bridge_schedules
+    ):
+        offload.withdraw(db)
+    run(disable=True, db=db, priority=True)
+    wake(db)
 
     return status
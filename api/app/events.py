@@ -0,0 +1,330 @@
+"""
+Live state of the lights
+
+A background thread for every bridge follows its event stream (Hue API v2)
+and keeps the state of every light in memory, so runs do not need to fetch
+all lights from the bridge. Bridges without an event stream are polled instead,
+the lights that are off are polled more often to notice when they are
+switched on. A stream that stays silent is given up, the runs read the
+bridge until it is connected and loaded again.
+
+Only the process of the scheduler follows the bridges, the gunicorn workers
+read them directly, so a bridge has a single stream or poller.
+"""
+
+from threading import Lock, Thread
+from typing import Optional
+import json
+import logging
+import os
+import time
+
+import requests
+
+log = logging.getLogger(__name__)
+
+# The event stream of the bridge, formatted with the bridge address
+EVENTS_URL = os.getenv(
+    'HUE_EVENTS_URL', 'https://{ipaddress}/eventstream/clip/v2'
+)
+# Seconds between two polls of bridges without an event stream
+POLL_INTERVAL = float(os.getenv('HUE_POLL_INTERVAL', '60'))
+# Requests per second to poll the lights that are off
+FAST_POLL_RATE = float(os.getenv('HUE_FAST_POLL_RATE', '2'))
+# Seconds to wait before connecting again
+RETRY_INTERVAL = 10
+# Failed connections before falling back to polling
+MAX_FAILURES = 3
+# Seconds without any data before the event stream is considered dead
+STREAM_TIMEOUT = float(os.getenv('HUE_STREAM_TIMEOUT', '120'))
+TIMEOUT = 10
+
+
+def light_id(event_data):
+    """ The v1 id of the light of an event, or None. """
+    id_v1 = event_data.get('id_v1') or ''
+    if event_data.get('type') != 'light' or not id_v1.startswith('/lights/'):
+        return None
+    return id_v1.rsplit('/', 1)[-1]
+
+
+def to_state(event_data):
+    """ Translate the v2 attributes of a light event to a v1 state. """
+    state = {}
+    if 'on' in event_data:
+        state['on'] = event_data['on'].get('on')
+    if 'dimming' in event_data:
+        state['bri'] = max(
+            1, round(event_data['dimming'].get('brightness', 0) * 2.54)
+        )
+    mirek = event_data.get('color_temperature', {}).get('mirek')
+    if mirek is not None:
+        state['ct'] = mirek
+        state['colormode'] = 'ct'
+    elif 'color' in event_data:
+        state['colormode'] = 'xy'
+    return state
+
+
+class LightStates:
+    """ The state of the lights of a bridge as last reported by it. """
+    def __init__(self, bridge, switched_on, changed=None):
+        self.bridge_id = bridge.id
+        self.ipaddress = bridge.ipaddress
+        self.username = bridge.username
+        self.mode = None
+        self.updated = None
+        # The last time the event stream delivered anything
+        self.received = None
+        self.stopped = False
+        self._switched_on = switched_on
+        self._changed = changed
+        self._states = {}
+        self._lock = Lock()
+
+    def start(self) -> None:
+        Thread(
+            target=self._follow, daemon=True,
+            name=f'hue-events-{self.bridge_id}'
+        ).start()
+
+    def ready(self) -> bool:
+        """ Whether the states are known and current. """
+        if self.stopped or self.updated is None or self.mode is None:
+            return False
+        if self.mode == 'events':
+            return time.monotonic() - self.received < STREAM_TIMEOUT
+        return time.monotonic() - self.updated < 2 * POLL_INTERVAL
+
+    def get(self, light_ids=None):
+        """ The states in the format of the /lights endpoint, None if a
+        light is unknown. """
+        with self._lock:
+            if light_ids is None:
+                light_ids = list(self._states)
+            if any(light_id not in self._states for light_id in light_ids):
+                return None
+            return {
+                light_id: {'state': dict(self._states[light_id])}
+                for light_id in light_ids
+            }
+
+    def apply(self, light_id, state, notify=False) -> None:
+        """ Update the state of a light, with `notify` the listeners learn
+        if it was switched on or changed. """
+        with self._lock:
+            current = self._states.setdefault(str(light_id), {})
+            switched_on = (
+                current.get('on') is False and state.get('on') is True
+            )
+            changed = any(
+                current.get(attribute) != value
+                for attribute, value in state.items()
+            )
+            current.update(state)
+        if notify and switched_on:
+            self._switched_on(self.bridge_id, str(light_id))
+        if notify and changed and self._changed is not None:
+            self._changed(self.bridge_id, str(light_id))
+
+    def load(self, hue_lights) -> None:
+        """ Replace the states with the lights read from the bridge. """
+        with self._lock:
+            previous, self._states = self._states, {
+                light_id: dict(hue_light.get('state', {}))
+                for light_id, hue_light in hue_lights.items()
+            }
+            self.updated = time.monotonic()
+        for light_id, state in self._states.items():
+            if previous.get(light_id, {}).get('on') is False and state.get(
+                'on'
+            ) is True:
+                self._switched_on(self.bridge_id, light_id)
+            if self._changed is not None and light_id in previous and (
+                previous[light_id] != state
+            ):
+                self._changed(self.bridge_id, light_id)
+
+    def _active(self) -> bool:
+        return not self.stopped
+
+    def _follow(self):
+        ipaddress, username = self.ipaddress, self.username
+        failures = 0
+        while self._active() and failures < MAX_FAILURES:
+            try:
+                self._stream(ipaddress, username)
+                failures = 0
+            except (requests.RequestException, ValueError) as e:
+                log.warning('event stream of %s failed: %s', ipaddress, e)
+                # Only count the failures of streams that never started
+                failures = 0 if self.mode == 'events' else failures + 1
+            self.mode = None
+            time.sleep(RETRY_INTERVAL)
+
+        log.info('polling %s every %ss', ipaddress, POLL_INTERVAL)
+        while self._active():
+            try:
+                self._poll(ipaddress, username)
+                self.mode = 'poll'
+            except (requests.RequestException, ValueError) as e:
+                log.warning('polling %s failed: %s', ipaddress, e)
+            self._poll_off(ipaddress, username, POLL_INTERVAL)
+
+    def _poll_off(self, ipaddress, username, duration):
+        """ Poll the lights that are off one by one for `duration`
+        seconds. """
+        end = time.monotonic() + duration
+        while self._active():
+            with self._lock:
+                off = [
+                    light_id for light_id, state in self._states.items()
+                    if state.get('on') is False
+                ]
+            if FAST_POLL_RATE <= 0 or not off:
+                time.sleep(max(0, end - time.monotonic()))
+                return
+            for light_id in off:
+                if time.monotonic() >= end:
+                    return
+                try:
+                    response = requests.get(
+                        f'http://{ipaddress}/api/{username}/lights/{light_id}',
+                        timeout=TIMEOUT
+                    )
+                    response.raise_for_status()
+                    self.apply(
+                        light_id, response.json().get('state', {}),
+                        notify=True
+                    )
+                except (requests.RequestException, ValueError) as e:
+                    log.warning('polling %s failed: %s', ipaddress, e)
+                time.sleep(1 / FAST_POLL_RATE)
+
+    def _poll(self, ipaddress, username):
+        response = requests.get(
+            f'http://{ipaddress}/api/{username}/lights', timeout=TIMEOUT
+        )
+        response.raise_for_status()
+        self.load(response.json())
+
+    def _stream(self, ipaddress, username):
+        with requests.get(
+            EVENTS_URL.format(ipaddress=ipaddress),
+            headers={
+                'hue-application-key': username,
+                'Accept': 'text/event-stream'
+            },
+            stream=True,
+            verify=False,
+            timeout=(TIMEOUT, STREAM_TIMEOUT)
+        ) as response:
+            response.raise_for_status()
+            content_type = response.headers.get('Content-Type', '')
+            if not content_type.startswith('text/event-stream'):
+                raise ValueError(f'no event stream, got {content_type}')
+            self._poll(ipaddress, username)
+            self.received = time.monotonic()
+            self.mode = 'events'
+            log.info('following the event stream of %s', ipaddress)
+
+            # Small reads, the events must not wait for a full buffer
+            for line in response.iter_lines(chunk_size=1):
+                self.received = time.monotonic()
+                line = line.decode()
+                if not self._active():
+                    return
+                if line and line.startswith('data:'):
+                    self.handle(line[5:].strip())
+
+    def handle(self, data) -> None:
+        """ Apply the light updates of an event stream message. """
+        try:
+            events = json.loads(data)
+        except ValueError:
+            log.warning('invalid event: %s', data)
+            return
+        for event in events:
+            if event.get('type') not in ('add', 'update'):
+                continue
+            for event_data in event.get('data', []):
+                id_v1 = light_id(event_data)
+                if id_v1 is not None:
+                    self.apply(id_v1, to_state(event_data), notify=True)
+        self.updated = time.monotonic()
+
+
+class BridgeStates:
+    """ The live states of the lights of every bridge. """
+    def __init__(self):
+        self._bridges = {}
+        self._pid = None
+        # The process that follows the bridges
+        self._owner = None
+        self._listeners = []
+        self._change_listeners = []
+        self._lock = Lock()
+
+    def enable(self) -> None:
+        """ Follow the bridges in this process, the others read them
+        directly. """
+        self._owner = os.getpid()
+
+    def listen(self, callback) -> None:
+        """ Call `callback(bridge_id, light_id)` in a new thread when a
+        light of this process is switched on. """
+        self._listeners.append((os.getpid(), callback))
+
+    def listen_changes(self, callback) -> None:
+        """ Call `callback(bridge_id, light_id)` in a new thread when the
+        state of a light of this process changed. """
+        self._change_listeners.append((os.getpid(), callback))
+
+    def _switched_on(self, bridge_id, light_id) -> None:
+        self._notify(self._listeners, bridge_id, light_id)
+
+    def _changed(self, bridge_id, light_id) -> None:
+        self._notify(self._change_listeners, bridge_id, light_id)
+
+    def _notify(self, listeners, bridge_id, light_id) -> None:
+        for pid, callback in listeners:
+            if pid == os.getpid():
+                Thread(
+                    target=callback, args=(bridge_id, light_id), daemon=True
+                ).start()
+
+    def watch(self, bridge) -> None:
+        """ Follow a bridge in the process the states were enabled in. """
+        if bridge is None or self._owner != os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._bridges = {}
+            current = self._bridges.get(bridge.id)
+            if current is not None and (
+                current.ipaddress, current.username
+            ) == (bridge.ipaddress, bridge.username):
+                return
+            if current is not None:
+                current.stopped = True
+            states = self._bridges[bridge.id] = LightStates(
+                bridge, self._switched_on, self._changed
+            )
+        states.start()
+
+    def of(self, bridge_id) -> Optional[LightStates]:
+        """ The states of a bridge followed by this process, or None. """
+        if self._pid != os.getpid():
+            return None
+        return self._bridges.get(bridge_id)
+
+    def forget(self, bridge_id) -> None:
+        """ Stop following a bridge. """
+        with self._lock:
+            states = self._bridges.pop(bridge_id, None)
+        if states is not None:
+            states.stopped = True
+
+
+states = BridgeStates()
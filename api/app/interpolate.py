@@ -2,9 +2,191 @@
 Interpolation
 """
 
+from array import array
+from bisect import bisect_right
 import math
 
 
+class MonotoneCubic:
+    """
+    Piecewise cubic interpolant with the coefficients stored as arrays
+    """
+    __slots__ = ('xs', 'ys', 'c1s', 'c2s', 'c3s')
+
+    def __init__(self, xs, ys, c1s, c2s, c3s):
+        self.xs = array('d', xs)
+        self.ys = array('d', ys)
+        self.c1s = array('d', c1s)
+        self.c2s = array('d', c2s)
+        self.c3s = array('d', c3s)
+
+    def __call__(self, x):
+        xs = self.xs
+        ys = self.ys
+        if not self.c3s:
+            return ys[0] if ys else 0
+
+        # The rightmost point in the dataset should give an exact result
+        if x == xs[-1]:
+            return ys[-1]
+
+        # Search for the interval x is in, returning the corresponding y if x
+        # is one of the original xs
+        i = bisect_right(xs, x, 0, len(self.c3s)) - 1
+        if i >= 0 and xs[i] == x:
+            return ys[i]
+        i = max(0, i)
+
+        # Interpolate
+        diff = x - xs[i]
+        return (ys[i] + self.c1s[i]*diff + self.c2s[i]*diff**2 +
+                self.c3s[i]*diff**3)
+
+    def evaluate(self, xs):
+        """
+        Evaluate the interpolant at many x values at once
+
+        The x values are visited in sorted order, so every interval is
+        searched only once.
+        """
+        knots = self.xs
+        ys = self.ys
+        count = len(self.c3s)
+        if not count:
+            return [ys[0] if ys else 0] * len(xs)
+
+        values = [0] * len(xs)
+        i = 0
+        for k in sorted(range(len(xs)), key=xs.__getitem__):
+            x = xs[k]
+            while i + 1 < count and knots[i+1] <= x:
+                i += 1
+
+            if x == knots[-1]:
+                values[k] = ys[-1]
+            elif x == knots[i]:
+                values[k] = ys[i]
+            else:
+                diff = x - knots[i]
+                values[k] = (ys[i] + self.c1s[i]*diff + self.c2s[i]*diff**2 +
+                             self.c3s[i]*diff**3)
+        return values
+
+    def crossings(self, level, lo, hi):
+        """
+        Find the x values in [lo, hi) where the interpolant crosses a level
+        """
+        knots = self.xs
+        count = len(self.c3s)
+        roots = []
+        for i in range(count):
+            seg_lo = max(lo, knots[i]) if i > 0 else lo
+            seg_hi = min(hi, knots[i+1]) if i < count - 1 else hi
+            if seg_lo >= seg_hi:
+                continue
+            roots.extend(knots[i] + d for d in _cubic_roots(
+                self.ys[i] - level, self.c1s[i], self.c2s[i], self.c3s[i],
+                seg_lo - knots[i], seg_hi - knots[i]
+            ))
+        return roots
+
+
+def _quadratic_roots(c0, c1, c2):
+    """ Real roots of c0 + c1*x + c2*x**2 """
+    if c2 == 0:
+        return [-c0/c1] if c1 != 0 else []
+    discriminant = c1**2 - 4*c2*c0
+    if discriminant < 0:
+        return []
+    q = -0.5 * (c1 + math.copysign(math.sqrt(discriminant), c1))
+    if q == 0:
+        return [0]
+    return sorted({q/c2, c0/q})
+
+
+def _cubic_roots(c0, c1, c2, c3, lo, hi):
+    """
+    Roots of c0 + c1*x + c2*x**2 + c3*x**3 in [lo, hi)
+
+    The interval is split at the extrema of the polynomial, every monotone
+    piece contains at most one root which is found by bisection.
+    """
+    def p(x):
+        return c0 + c1*x + c2*x**2 + c3*x**3
+
+    bounds = [lo] + [
+        x for x in _quadratic_roots(c1, 2*c2, 3*c3) if lo < x < hi
+    ] + [hi]
+
+    roots = []
+    for left, right in zip(bounds, bounds[1:]):
+        p_left = p(left)
+        p_right = p(right)
+        if p_left == 0:
+            roots.append(left)
+            continue
+        if p_left * p_right >= 0:
+            continue
+        for _ in range(100):
+            mid = 0.5 * (left + right)
+            if mid in (left, right):
+                break
+            p_mid = p(mid)
+            if p_mid == 0:
+                left = right = mid
+                break
+            if (p_mid < 0) == (p_left < 0):
+                left, p_left = mid, p_mid
+            else:
+                right = mid
+        roots.append(0.5 * (left + right))
+    return roots
+
+
+def simplify(xs, ys, tolerance):
+    """
+    Ramer-Douglas-Peucker simplification of a sorted point set
+
+    Returns the indices of the points to keep, so that no dropped point
+    deviates more than `tolerance` in y from the line between its kept
+    neighbours. The first and the last point are always kept.
+    """
+    length = len(xs)
+    if length < 3:
+        return list(range(length))
+
+    keep = [False] * length
+    keep[0] = keep[-1] = True
+    stack = [(0, length - 1)]
+    while stack:
+        start, end = stack.pop()
+        slope = (ys[end] - ys[start]) / (xs[end] - xs[start])
+        max_error = -1
+        index = None
+        for i in range(start + 1, end):
+            error = abs(ys[start] + slope * (xs[i] - xs[start]) - ys[i])
+            if error > max_error:
+                max_error = error
+                index = i
+        if index is not None and max_error > tolerance:
+            keep[index] = True
+            stack.append((start, index))
+            stack.append((index, end))
+
+    return [i for i in range(length) if keep[i]]
+
+
+def evaluate_many(splines, x):
+    """
+    Evaluate many interpolants at the same x value
+    """
+    values = {}
+    for spline in splines:
+        if id(spline) not in values:
+            values[id(spline)] = spline(x)
+    return [values[id(spline)] for spline in splines]
+
+
 def monospline(xs, ys):
     """
     Monotone cubic interpolation
@@ -13,10 +195,8 @@ def monospline(xs, ys):
     length = len(xs)
     if length != len(ys):
         raise ValueError('Need an equal count of xs and ys')
-    if length == 0:
-        return lambda x: 0
-    if length == 1:
-        return lambda x: ys[0]
+    if length < 2:
+        return MonotoneCubic(xs, ys, [], [], [])
 
     # Rearrange xs and ys so that xs is sorted
     old_xs, old_ys = xs, ys
@@ -61,30 +241,4 @@ def monospline(xs, ys):
         c2s.append((m_ - c1 - common_) * inv_dx)
         c3s.append(common_ * inv_dx**2)
 
-    # Return interpolant function
-    def interpolant(x):
-        # The rightmost point in the dataset should give an exact result
-        if x == xs[-1]:
-            return ys[-1]
-
-        # Search for the interval x is in, returning the corresponding y if x
-        # is one of the original xs
-        low = 0
-        high = len(c3s) - 1
-        while low <= high:
-            mid = math.floor(0.5 * (low + high))
-            x_here = xs[mid]
-
-            if x_here < x:
-                low = mid + 1
-            elif x_here > x:
-                high = mid - 1
-            else:
-                return ys[mid]
-        i = max(0, high)
-
-        # Interpolate
-        diff = x - xs[i]
-        return ys[i] + cls[i]*diff + c2s[i]*diff**2 + c3s[i]*diff**3
-
-    return interpolant
+    return MonotoneCubic(xs, ys, cls, c2s, c3s)
@@ -7,7 +7,7 @@ from fastapi.staticfiles import StaticFiles
 from starlette.responses import RedirectResponse
 from apscheduler.schedulers.background import BackgroundScheduler
 
-from app import endpoints, schedules
+from app import endpoints, events, schedules
 from app.init_database import init
 
 app = FastAPI()
@@ -91,6 +91,11 @@ api.include_router(
     prefix='/settings',
     tags=['settings']
 )
+api.include_router(
+    endpoints.plan.router,
+    prefix='/plan',
+    tags=['plan']
+)
 
 app.mount('/api', api)
 app.mount('/app', StaticFiles(directory='build', html=True), name='app')
@@ -99,9 +104,21 @@ app.mount('/', RedirectResponse(url='/app/'))
 init()
 
 scheduler = BackgroundScheduler()
+# A scheduled run waits for its commands spread across the stagger
+# window, the next run may start meanwhile. Its commands are merged with
+# the pending ones in the queues, missed runs are only made up once.
 job_run = scheduler.add_job(
-    schedules.scheduled_run, trigger='interval', minutes=1
+    schedules.scheduled_run, trigger=schedules.trigger,
+    max_instances=2, coalesce=True
+)
+schedules.trigger.job = job_run
+job_wake = scheduler.add_job(
+    schedules.check_revision, trigger='interval',
+    seconds=schedules.WAKE_INTERVAL
 )
+events.states.enable()
+events.states.listen(schedules.react)
+events.states.listen_changes(schedules.react_change)
 job_offsets = scheduler.add_job(
     schedules.scheduled_daily_cleanup, trigger='cron', hour=4
 )
@@ -6,9 +6,17 @@ from sqlalchemy import (
     Float,
     ForeignKey,
     Table,
+    UniqueConstraint,
 )
 from sqlalchemy.orm import relationship, backref
 from .database import Base
+import uuid
+
+
+def new_revision() -> str:
+    """ A revision that is unique across all curves, ids of deleted curves
+    are given to new ones again. """
+    return uuid.uuid4().hex
 
 
 class Status(Base):
@@ -16,6 +24,8 @@ class Status(Base):
 
     id = Column(Integer, nullable=False, primary_key=True)
     status = Column(Boolean, nullable=False, default=False)
+    # Counts the config changes, the scheduler runs early after one
+    revision = Column(Integer, nullable=False, default=0)
 
 
 class Settings(Base):
@@ -23,6 +33,20 @@ class Settings(Base):
 
     id = Column(Integer, nullable=False, primary_key=True)
     smart_off = Column(Boolean, nullable=False, default=True)
+    dynamic_groups = Column(Boolean, nullable=False, default=False)
+    # Smallest bri and ct changes that are sent to the lights
+    bri_deadband = Column(Integer, nullable=False, default=0)
+    ct_deadband = Column(Integer, nullable=False, default=0)
+    # Minutes after which a smaller change is sent anyway
+    max_staleness = Column(Integer, nullable=False, default=15)
+    # Minutes the bridge fades towards the next target, 0 jumps instantly
+    transition_window = Column(Integer, nullable=False, default=0)
+    # Seconds the commands of a scheduled run are spread across
+    stagger_window = Column(Integer, nullable=False, default=0)
+    # Execute the plan with schedules on the bridge, sampled every
+    # `schedule_resolution` minutes
+    bridge_schedules = Column(Boolean, nullable=False, default=False)
+    schedule_resolution = Column(Integer, nullable=False, default=15)
 
 
 class Curve(Base):
@@ -32,6 +56,7 @@ class Curve(Base):
     kind = Column(String(50), nullable=False)
     default = Column(Boolean, nullable=False, default=False)
     offset = Column(Float, nullable=False, default=0)
+    revision = Column(String(32), nullable=False, default=new_revision)
 
     points = relationship(
         'Point',
@@ -78,6 +103,14 @@ association_group_light = Table(
     Column('group_id', Integer, ForeignKey('group.id'))
 )
 
+# Association table for many-to-many relationship cluster<->light
+association_cluster_light = Table(
+    'association_cluster_light',
+    Base.metadata,
+    Column('light_id', Integer, ForeignKey('light.id')),
+    Column('cluster_id', Integer, ForeignKey('cluster.id'))
+)
+
 # Association table for many-to-many relationship light<->webhook
 association_light_webhook = Table(
     'association_light_webhook',
@@ -98,8 +131,16 @@ association_group_webhook = Table(
 class Light(Base):
     """ A single Light """
     __tablename__ = 'light'
+    __table_args__ = (
+        UniqueConstraint(
+            'bridge_id', 'hue_id', name='uq_light_bridge_id_hue_id'
+        ),
+    )
 
     id = Column(Integer, primary_key=True)
+    # The bridge of the light and the id of the light on it
+    bridge_id = Column(String(16), ForeignKey('bridge.id'))
+    hue_id = Column(String)
     name = Column(String)
     type = Column(String)
     modelid = Column(String)
@@ -131,6 +172,8 @@ class Light(Base):
         foreign_keys=[ct_curve_id]
     )
 
+    bridge = relationship('Bridge', back_populates='lights')
+
     position = relationship(
         'Position',
         back_populates='light',
@@ -147,11 +190,20 @@ class Light(Base):
 
 class Group(Base):
     __tablename__ = 'group'
+    __table_args__ = (
+        UniqueConstraint(
+            'bridge_id', 'hue_id', name='uq_group_bridge_id_hue_id'
+        ),
+    )
 
     id = Column(Integer, primary_key=True)
+    bridge_id = Column(String(16), ForeignKey('bridge.id'))
+    hue_id = Column(String)
     name = Column(String)
     type = Column(String)
 
+    bridge = relationship('Bridge', back_populates='groups')
+
     lights = relationship(
         'Light',
         secondary=association_group_light
@@ -171,6 +223,29 @@ class Group(Base):
     )
 
 
+class Cluster(Base):
+    """ A bridge group managed by ambientHUE for lights with identical
+    schedules """
+    __tablename__ = 'cluster'
+    __table_args__ = (
+        UniqueConstraint(
+            'bridge_id', 'hue_id', name='uq_cluster_bridge_id_hue_id'
+        ),
+    )
+
+    id = Column(Integer, primary_key=True)
+    bridge_id = Column(String(16), ForeignKey('bridge.id'))
+    hue_id = Column(String)
+    key = Column(String, nullable=False)
+
+    bridge = relationship('Bridge', back_populates='clusters')
+
+    lights = relationship(
+        'Light',
+        secondary=association_cluster_light
+    )
+
+
 class Bridge(Base):
     """ Hue Bridge """
     __tablename__ = 'bridge'
@@ -180,6 +255,25 @@ class Bridge(Base):
     ipaddress = Column(String, nullable=False)
     username = Column(String)
 
+    lights = relationship(
+        'Light',
+        back_populates='bridge',
+        cascade='all,delete',
+        order_by='Light.id'
+    )
+    groups = relationship(
+        'Group',
+        back_populates='bridge',
+        cascade='all,delete',
+        order_by='Group.id'
+    )
+    clusters = relationship(
+        'Cluster',
+        back_populates='bridge',
+        cascade='all,delete',
+        order_by='Cluster.id'
+    )
+
 
 class Header(Base):
     __tablename__ = 'header'
@@ -0,0 +1,327 @@
+"""
+Offload of the daily plan to the schedules of the bridge
+
+The plan of the day is sampled at the schedule resolution and uploaded as
+recurring schedules to the bridge of each light, the bridge fades between
+the samples. Lights that share a plan and form a group are scheduled with
+group actions. The schedules are recognized by the prefix of their name.
+"""
+
+from bisect import bisect_right
+from fastapi import HTTPException
+from sqlalchemy.orm import Session
+from threading import Lock
+import logging
+import math
+
+from app import crud
+from app.api import api_from_bridge
+from app.cache import MINUTES
+from app.models import Bridge
+from app.plan import UNSET, DayPlan, LightPlan
+
+log = logging.getLogger(__name__)
+
+# Schedules a bridge can store
+MAX_SCHEDULES = 100
+# The longest transition time of the bridge in minutes
+MAX_RESOLUTION = 100
+NAME = 'ambientHUE'
+
+
+class Target:
+    """ A light or a group of lights with the same plan. """
+    __slots__ = (
+        'path', 'light_ids', 'light_plan', 'events', 'schedules', 'paused'
+    )
+
+    def __init__(self, path, light_ids, light_plan: LightPlan):
+        self.path = path
+        self.light_ids = light_ids
+        self.light_plan = light_plan
+        # (time in seconds, body) of the commands of the day
+        self.events = []
+        # The ids of the uploaded schedules
+        self.schedules = []
+        self.paused = False
+
+    def expected(self, seconds):
+        """ The bodies of the last two commands at a time of the day. """
+        if not self.events:
+            return None, None
+        i = bisect_right([time for time, _ in self.events], seconds) - 1
+        return self.events[i - 1][1], self.events[i][1]
+
+
+class Offload:
+    """ The state of the schedules uploaded to a bridge. """
+    def __init__(self):
+        self.key = None
+        self.active = False
+        self.targets = []
+        self._lock = Lock()
+
+
+_states = {}
+_states_lock = Lock()
+
+
+def state_of(bridge_id) -> Offload:
+    """ The offload state of a bridge. """
+    with _states_lock:
+        state = _states.get(bridge_id)
+        if state is None:
+            state = _states[bridge_id] = Offload()
+        return state
+
+
+def active(bridges) -> bool:
+    """ Whether every bridge executes the plan itself. """
+    return bool(bridges) and all(
+        state_of(bridge.id).active for bridge in bridges
+    )
+
+
+def get_targets(bridge: Bridge, day_plan: DayPlan):
+    """ Collect the lights of a bridge with the same plan into its
+    groups. """
+    lights = {light.id: light for light in bridge.lights}
+    shared = {}
+    for light_id, light_plan in day_plan.lights.items():
+        if light_id in lights:
+            shared.setdefault(id(light_plan), (light_plan, []))[1].append(
+                light_id
+            )
+
+    groups = {
+        frozenset(lights): '0'
+    }
+    for group in bridge.groups + bridge.clusters:
+        groups.setdefault(
+            frozenset(light.id for light in group.lights), group.hue_id
+        )
+
+    targets = []
+    for light_plan, light_ids in shared.values():
+        group_id = groups.get(frozenset(light_ids))
+        if len(light_ids) > 1 and group_id is not None:
+            targets.append(Target(
+                f'/groups/{group_id}/action', light_ids, light_plan
+            ))
+        else:
+            targets.extend(
+                Target(
+                    f'/lights/{lights[light_id].hue_id}/state', [light_id],
+                    light_plan
+                )
+                for light_id in light_ids
+            )
+    return targets
+
+
+def body_of(bri, ct):
+    body = {}
+    if bri != UNSET:
+        body['bri'] = bri
+    if ct != UNSET:
+        body['ct'] = ct
+    return body
+
+
+def compile_events(light_plan: LightPlan, resolution):
+    """ Sample a plan every `resolution` minutes, each sample fades to the
+    target of the next one. The switches of the on state are added at
+    their time. """
+    events = []
+    previous = None
+    for minute in range(0, MINUTES, resolution):
+        end = min(minute + resolution, MINUTES)
+        bri, ct, on = light_plan.target(end % MINUTES)
+        sample = body_of(bri, ct)
+        if on == 0 or not sample or sample == previous:
+            continue
+        previous = sample
+        events.append(
+            (minute*60, dict(sample, transitiontime=(end - minute)*600))
+        )
+
+    for i, (time, bri, ct, on) in enumerate(light_plan.events()):
+        if on == UNSET or on == light_plan.on[i - 1]:
+            continue
+        body = {'on': bool(on)}
+        if on:
+            body.update(body_of(bri, ct))
+        events.append((math.ceil(time*60) % (MINUTES*60), body))
+
+    events.sort(key=lambda event: event[0])
+    return events
+
+
+def compile_targets(targets, resolution):
+    """ Compile the targets with the finest resolution that fits the
+    bridge, None if they do not fit. """
+    while resolution <= MAX_RESOLUTION:
+        for target in targets:
+            target.events = compile_events(target.light_plan, resolution)
+        if sum(len(target.events) for target in targets) <= MAX_SCHEDULES:
+            return resolution
+        resolution *= 2
+    return None
+
+
+def localtime(seconds):
+    """ The recurring local time of the bridge for every day. """
+    seconds = int(seconds)
+    return (f'W127/T{seconds // 3600:02}:{seconds // 60 % 60:02}:'
+            f'{seconds % 60:02}')
+
+
+def remove(api) -> None:
+    """ Delete all schedules of ambientHUE from the bridge. """
+    for schedule_id, schedule in api.get('/schedules').items():
+        if schedule.get('name', '').startswith(NAME):
+            api.delete(f'/schedules/{schedule_id}')
+
+
+def withdraw(db: Session) -> None:
+    """ Remove the schedules from every bridge right after the offload was
+    switched off, the next sync only follows with the scheduled run. """
+    for bridge in crud.bridge.get_all(db):
+        try:
+            remove(api_from_bridge(bridge))
+        except HTTPException as e:
+            log.error(
+                'removing the schedules from %s failed: %s',
+                bridge.name, e.detail
+            )
+
+
+def forget(db: Session, bridge: Bridge) -> None:
+    """ Remove the schedules from a bridge that is no longer used. """
+    with _states_lock:
+        _states.pop(bridge.id, None)
+    if not crud.settings.get(db).bridge_schedules:
+        return
+    try:
+        remove(api_from_bridge(bridge))
+    except HTTPException as e:
+        log.error(
+            'removing the schedules from %s failed: %s', bridge.name, e.detail
+        )
+
+
+def sync(db: Session, bridge: Bridge, day_plan: DayPlan) -> bool:
+    """ Upload the schedules of a bridge after the plan or the settings
+    changed. Returns whether the bridge executes the plan. """
+    api = api_from_bridge(bridge)
+    settings = crud.settings.get(db)
+    status = crud.status.get(db)
+    enabled = settings.bridge_schedules and status.status
+    # The targets depend on the groups and clusters of the bridge
+    groups = frozenset(
+        (group.hue_id, frozenset(light.id for light in group.lights))
+        for group in bridge.groups + bridge.clusters
+    )
+    key = (
+        day_plan.fingerprint, enabled, settings.schedule_resolution,
+        bridge.ipaddress, bridge.username, groups
+    )
+    state = state_of(bridge.id)
+    with state._lock:
+        if key == state.key:
+            return state.active
+
+        try:
+            remove(api)
+            state.active = False
+            state.targets = []
+            if enabled:
+                state.active = upload(
+                    api, bridge, day_plan, settings.schedule_resolution
+                )
+        except HTTPException as e:
+            log.error('uploading schedules failed: %s', e.detail)
+            return False
+        state.key = key
+        return state.active
+
+
+def upload(api, bridge: Bridge, day_plan, resolution) -> bool:
+    targets = get_targets(bridge, day_plan)
+    resolution = compile_targets(targets, resolution)
+    if resolution is None:
+        log.error('too many lights to offload the plan to %s', bridge.name)
+        return False
+
+    index = 0
+    for target in targets:
+        for time, body in target.events:
+            index += 1
+            response = api.post('/schedules', json={
+                'name': f'{NAME} {index}',
+                'description': target.path,
+                'command': {
+                    'address': f'/api/{bridge.username}{target.path}',
+                    'method': 'PUT',
+                    'body': body
+                },
+                'localtime': localtime(time),
+                'status': 'enabled',
+                'autodelete': False
+            })
+            target.schedules.append(response[0]['success']['id'])
+    state_of(bridge.id).targets = targets
+    log.info(
+        'Uploaded %s schedules to %s with a resolution of %s minutes',
+        index, bridge.name, resolution
+    )
+    return True
+
+
+def check_smart_off(db: Session, bridge: Bridge, seconds, hue_lights) -> None:
+    """ Pause the schedules of a target while any of its lights was changed
+    by hand, resume them after the smart off was reset. """
+    api = api_from_bridge(bridge)
+    lights = {light.id: light for light in bridge.lights}
+    for target in state_of(bridge.id).targets:
+        previous, expected = target.expected(seconds)
+        active = False
+        for light_id in target.light_ids:
+            light = lights.get(light_id)
+            if light is None or expected is None:
+                continue
+            hue_state = hue_lights.get(light.hue_id, {}).get('state', {})
+            if not light.smart_off_active and changed_by_hand(
+                hue_state, previous, expected
+            ):
+                log.debug('Smart Off for light %s', light_id)
+                light.smart_off_active = True
+            active = active or light.smart_off_active
+
+        if active != target.paused:
+            status = 'disabled' if active else 'enabled'
+            for schedule_id in target.schedules:
+                api.put(f'/schedules/{schedule_id}', json={'status': status})
+            target.paused = active
+    db.commit()
+
+
+def changed_by_hand(hue_state, previous, expected) -> bool:
+    """ Whether a state differs from the last command, values of a running
+    transition are within the previous and the expected one. """
+    if 'on' in expected and hue_state.get('on') != expected['on']:
+        return True
+    if hue_state.get('on') is False:
+        return False
+    for attribute in ('bri', 'ct'):
+        if attribute not in expected:
+            continue
+        values = [expected[attribute]]
+        if previous and attribute in previous:
+            values.append(previous[attribute])
+        value = hue_state.get(attribute)
+        if value is None or not (
+            min(values) - 2 <= value <= max(values) + 2
+        ):
+            return True
+    return False
@@ -0,0 +1,137 @@
+"""
+Daily command plan
+
+The plan holds every change of the target state of the lights across a day.
+The changes of a light are stored in compact arrays, a timer wheel with a
+slot for every minute of the day lists the lights with a change in it.
+"""
+
+from array import array
+from bisect import bisect_left, bisect_right
+from threading import Lock
+
+from app.cache import MINUTES
+
+# Marks a value that is not controlled
+UNSET = -1
+
+
+class LightPlan:
+    """ The target changes of the lights that share a schedule, the times
+    are in minutes of the day. """
+    __slots__ = ('times', 'bri', 'ct', 'on')
+
+    def __init__(self):
+        self.times = array('d')
+        self.bri = array('h')
+        self.ct = array('h')
+        self.on = array('b')
+
+    def __len__(self):
+        return len(self.times)
+
+    def add(self, time, bri, ct, on) -> None:
+        self.times.append(time)
+        self.bri.append(bri)
+        self.ct.append(ct)
+        self.on.append(on)
+
+    def target(self, time):
+        """ The (bri, ct, on) target at a time, the last change of the day
+        holds until the first one. """
+        i = bisect_right(self.times, time) - 1
+        return self.bri[i], self.ct[i], self.on[i]
+
+    def events(self):
+        return zip(self.times, self.bri, self.ct, self.on)
+
+    def commands(self) -> int:
+        """ The number of commands the plan sends in a day. """
+        count = 0
+        for i, (_, bri, ct, on) in enumerate(self.events()):
+            prev_bri, prev_ct, prev_on = (
+                self.bri[i - 1], self.ct[i - 1], self.on[i - 1]
+            )
+            if on != prev_on or (on != 0 and (
+                bri != prev_bri or ct != prev_ct
+            )):
+                count += 1
+        return count
+
+    def times_in(self, minute):
+        """ The change times within a minute of the day. """
+        return self.times[
+            bisect_left(self.times, minute):bisect_left(self.times, minute + 1)
+        ]
+
+    def is_switch(self, time) -> bool:
+        """ Whether the on state changes at a time of the plan. """
+        i = bisect_left(self.times, time)
+        return self.on[i] != self.on[i - 1]
+
+
+class DayPlan:
+    """ The plans of all lights and their timer wheel. """
+    def __init__(self, fingerprint=None):
+        self.fingerprint = fingerprint
+        self.lights = {}
+        self.wheel = [[] for _ in range(MINUTES)]
+        # The time of day up to which the changes were executed
+        self.cursor = None
+        # The time of the last run of all lights
+        self.full_run = None
+        self._lock = Lock()
+
+    def add(self, light_id, light_plan: LightPlan) -> None:
+        self.lights[light_id] = light_plan
+        for time in light_plan.times:
+            slot = self.wheel[int(time) % MINUTES]
+            if not slot or slot[-1] != light_id:
+                slot.append(light_id)
+
+    def commands(self) -> int:
+        return sum(
+            light_plan.commands() for light_plan in self.lights.values()
+        )
+
+    def next_event(self, time, switches_only=False):
+        """ The next time after `time` a target changes, or None. With
+        `switches_only` only changes of the on state count. """
+        minute = int(time)
+        for step in range(MINUTES + 1):
+            slot = (minute + step) % MINUTES
+            day = minute + step - slot
+            found = [
+                day + change
+                for light_id in self.wheel[slot]
+                for change in self.lights[light_id].times_in(slot)
+                if day + change > time and (
+                    not switches_only
+                    or self.lights[light_id].is_switch(change)
+                )
+            ]
+            if found:
+                return min(found)
+        return None
+
+    def pop_due(self, time):
+        """ Advance the cursor to `time` and return the ids of the lights
+        with a change since the last call, None if unknown. """
+        with self._lock:
+            cursor, self.cursor = self.cursor, time
+        if cursor is None:
+            return None
+
+        if time < cursor:
+            time += MINUTES
+        due = set()
+        for minute in range(int(cursor), int(time) + 1):
+            slot = minute % MINUTES
+            day = minute - slot
+            for light_id in self.wheel[slot]:
+                if any(
+                    cursor < day + change <= time
+                    for change in self.lights[light_id].times_in(slot)
+                ):
+                    due.add(light_id)
+        return due
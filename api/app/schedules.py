@@ -1,37 +1,221 @@
 from fastapi import HTTPException
-from app import models, crud
+from app import models, crud, cache, events, offload, plan
 from app.database import SessionLocal
-from app.api import get_api
+from app.api import api_from_bridge
+from app.dispatch import acknowledged, dispatch, group_command, light_command
 from sqlalchemy.orm import Session
+from typing import List
+from apscheduler.jobstores.base import JobLookupError
+from apscheduler.triggers.base import BaseTrigger
+from apscheduler.util import astimezone
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from time import sleep
+from tzlocal import get_localzone
+import datetime as dt
 import logging
+import math
 
 
 log = logging.getLogger(__name__)
 
+# Maximum time in minutes between two scheduled runs
+MAX_SLEEP = 10
 
-def calc_brightness(db: Session, light: models.Light):
-    """ Calculate the current brightness for a light. """
-    curve = light.bri_curve
-    if not curve:
-        curve = crud.curve.get_default_by_kind(db, kind='bri')
-    curve_value = crud.curve.calc_value(db=db, curve=curve)
-    return int((light.bri_max/254) * curve_value)
+# Seconds between two checks of the config revision
+WAKE_INTERVAL = 5
 
+# Runs for fewer lights fetch the state of each light on its own
+SCOPED_FETCH_LIMIT = 5
 
-def calc_color_temp(db: Session, light: models.Light):
-    """ Calculate the current color temperature for a light. """
-    curve = light.ct_curve
-    if not curve:
-        curve = crud.curve.get_default_by_kind(db, kind='ct')
-    return crud.curve.calc_value(db=db, curve=curve)
+# Seconds the group table read from a bridge is trusted
+GROUPS_TTL = 60
 
+# Seconds the changes of an offloaded bridge settle before Smart Off is
+# checked, a schedule changes many lights at once
+SMART_OFF_SETTLE = 1
+
+
+class NextChangeTrigger(BaseTrigger):
+    """ Fires at the next minute the target state of any light changes. """
+    def __init__(self, timezone=None):
+        self.timezone = astimezone(timezone) or get_localzone()
+        self.job = None
+        # The config revision the scheduled run was planned with
+        self.revision = None
+
+    def get_next_fire_time(self, previous_fire_time, now):
+        if previous_fire_time is None:
+            return now
+        db = SessionLocal()
+        try:
+            return self.next_fire_time(db, previous_fire_time)
+        finally:
+            db.close()
+
+    def next_fire_time(self, db: Session, now: dt.datetime) -> dt.datetime:
+        now = now.astimezone(self.timezone)
+        local_now = now.replace(tzinfo=None)
+        return self.timezone.normalize(
+            now + (next_change(db, local_now) - local_now)
+        )
+
+    def __str__(self):
+        return 'next_change'
+
+
+trigger = NextChangeTrigger()
+
+
+def default_curves(db: Session):
+    """ The default curve of each kind, resolved once for a run. """
+    return {
+        kind: crud.curve.get_default_by_kind(db, kind=kind)
+        for kind in ('bri', 'ct')
+    }
+
+
+def curve_of(db: Session, light: models.Light, kind, defaults=None):
+    """ The curve of a kind a light follows, `defaults` may hold the
+    default curves. """
+    curve = getattr(light, f'{kind}_curve')
+    if curve:
+        return curve
+    if defaults is not None:
+        return defaults[kind]
+    return crud.curve.get_default_by_kind(db, kind=kind)
+
+
+def calc_brightness(
+    db: Session, light: models.Light, minute=None, defaults=None
+):
+    """ Calculate the current brightness for a light, or the brightness at
+    a minute of the day. """
+    curve = curve_of(db, light, 'bri', defaults)
+    if minute is None:
+        curve_value = crud.curve.calc_value(db=db, curve=curve)
+    else:
+        curve_value = crud.curve.value_at(curve, minute)
+    return scale_brightness(light, curve_value)
+
+
+def scale_brightness(light: models.Light, curve_value: int):
+    """ Scale a brightness curve value to the maximum of a light. """
+    return int((light.bri_max/254) * curve_value)
 
-def get_request_body(db, light, prev_light_state):
-    """ Build the request body for the hue api."""
-    body = {}
 
-    brightness = calc_brightness(db=db, light=light)
-    color_temp = calc_color_temp(db=db, light=light)
+def calc_color_temp(
+    db: Session, light: models.Light, minute=None, defaults=None
+):
+    """ Calculate the current color temperature for a light, or the color
+    temperature at a minute of the day. """
+    curve = curve_of(db, light, 'ct', defaults)
+    if minute is None:
+        return crud.curve.calc_value(db=db, curve=curve)
+    return crud.curve.value_at(curve, minute)
+
+
+def time_of_day(now: dt.datetime) -> float:
+    """ The time of day in minutes. """
+    return now.hour*60 + now.minute + (now.second + now.microsecond/1e6)/60
+
+
+def window_end(now: dt.datetime, window: int) -> int:
+    """ The minute of the day the transition window of `now` ends. """
+    minute = now.hour*60 + now.minute
+    return (minute // window + 1) * window
+
+
+def calc_crossings(
+    db: Session, light: models.Light, defaults=None
+) -> cache.Crossings:
+    """ Get the times a light crosses its on threshold. """
+    curve = curve_of(db, light, 'bri', defaults)
+    key = crud.curve.compile(curve).key
+    return cache.crossings.get(
+        (key, curve.offset, light.bri_max, light.on_threshold),
+        lambda: build_crossings(light, curve)
+    )
+
+
+def build_crossings(light: models.Light, curve: models.Curve):
+    """ Find the times the brightness curve of a light crosses the on
+    threshold in the roots of the piecewise cubic curve. """
+    spline = crud.curve.compile(curve).spline
+
+    def is_on(time):
+        value = int(spline(time - cache.X_SHIFT) + curve.offset)
+        return scale_brightness(light, value) > light.on_threshold
+
+    times = []
+    scale = light.bri_max/254
+    if scale > 0:
+        # Lowest integer curve value that switches the light on
+        level = math.floor(light.on_threshold / scale)
+        while scale_brightness(light, level) <= light.on_threshold:
+            level += 1
+        while scale_brightness(light, level - 1) > light.on_threshold:
+            level -= 1
+        if level <= 0:
+            level -= 1
+
+        times = [
+            x + cache.X_SHIFT for x in spline.crossings(
+                level - curve.offset,
+                -cache.X_SHIFT,
+                cache.MINUTES - cache.X_SHIFT
+            )
+        ]
+
+    bounds = [0] + times + [cache.MINUTES]
+    states = [
+        is_on(0.5 * (start + end)) for start, end in zip(bounds, bounds[1:])
+    ]
+
+    # Drop touching points that do not change the state
+    crossings = cache.Crossings(times=[], states=states[:1])
+    for time, state in zip(times, states[1:]):
+        if state != crossings.states[-1]:
+            crossings.times.append(time)
+            crossings.states.append(state)
+    return crossings
+
+
+def within_deadband(light, attribute, value, prev_light_state, settings):
+    """ Whether a change is too small to be sent yet. """
+    deadband = getattr(settings, f'{attribute}_deadband', 0)
+    shown = prev_light_state.get(attribute)
+    if not deadband or not isinstance(shown, (int, float)):
+        return False
+    if attribute == 'ct' and prev_light_state.get('colormode', 'ct') != 'ct':
+        return False
+    if abs(value - shown) >= deadband:
+        return False
+    age = cache.sent.age(light.id, attribute)
+    return age is not None and age < settings.max_staleness*60
+
+
+def get_request_body(
+    db, light, prev_light_state, settings=None, now=None, defaults=None,
+    immediate=False
+):
+    """ Build the request body for the hue api, for the time the request
+    is sent. `defaults` may hold the default curves of the run. Bodies that
+    are `immediate` carry the current values without a fade or deadband,
+    e.g. to correct a light that was just switched on. """
+    body = {}
+    if now is None:
+        now = dt.datetime.now()
+    minute = now.hour*60 + now.minute
+    if defaults is None:
+        defaults = default_curves(db)
+
+    brightness = calc_brightness(
+        db=db, light=light, minute=minute, defaults=defaults
+    )
+    color_temp = calc_color_temp(
+        db=db, light=light, minute=minute, defaults=defaults
+    )
 
     if light.ct_controlled:
         body['ct'] = color_temp
@@ -40,7 +224,7 @@ def get_request_body(db, light, prev_light_state):
     if light.on_controlled:
         if light.on is False:
             body['on'] = False
-        elif brightness > light.on_threshold:
+        elif calc_crossings(db, light, defaults).is_on(time_of_day(now)):
             body['on'] = True
         else:
             body['on'] = False
@@ -56,24 +240,255 @@ def get_request_body(db, light, prev_light_state):
     if body.get('on') == prev_light_state.get('on'):
         del body['on']
 
+    if settings is None:
+        settings = crud.settings.get(db)
+    stays_on = (
+        not immediate
+        and 'on' not in body and prev_light_state.get('on') is True
+    )
+
+    # Lights that stay on fade towards the target at the end of the window
+    window = settings.transition_window
+    if window and stays_on:
+        end = window_end(now, window)
+        if 'bri' in body:
+            body['bri'] = calc_brightness(
+                db=db, light=light, minute=end, defaults=defaults
+            )
+        if 'ct' in body:
+            body['ct'] = calc_color_temp(
+                db=db, light=light, minute=end, defaults=defaults
+            )
+
+    # Hold back small changes of lights that stay on
+    if 'on' not in body and not immediate:
+        for attribute in ('bri', 'ct'):
+            if attribute in body and within_deadband(
+                light, attribute, body[attribute], prev_light_state, settings
+            ):
+                del body[attribute]
+
+    if window and stays_on and body:
+        body['transitiontime'] = round((end - time_of_day(now)) * 600)
+
     log.debug('body: %s', body)
     return body
 
 
-def run(disable=False, lights=None, db=None, api=None):
-    """ Calculate and execute the current state"""
+def drop_unchanged(light, body, prev_light_state):
+    """ Remove the attributes the light already shows from the body. """
+    for attribute in ('bri', 'ct'):
+        if attribute not in body:
+            continue
+        # A light in another color mode does not show its ct
+        if attribute == 'ct' and (
+            prev_light_state.get('colormode', 'ct') != 'ct'
+        ):
+            continue
+        if cache.sent.is_current(
+            light.id, attribute, body[attribute], prev_light_state
+        ):
+            del body[attribute]
+
+    # A transition time alone changes nothing
+    if list(body) == ['transitiontime']:
+        return {}
+    return body
+
+
+def phase(light: models.Light, window) -> float:
+    """ The stable offset of a light in the stagger window, in seconds. """
+    return (light.id * 0.618033988749895) % 1 * window
+
+
+def get_affected_lights(db: Session, curves: List[models.Curve]):
+    """ Get the lights that follow any of the curves. """
+    lights = {}
+    for curve in curves:
+        for light in crud.light.get_multi_by_curve(db, curve=curve):
+            lights[light.id] = light
+    return list(lights.values())
+
+
+def get_light_states(api, live, light_ids=None):
+    """ Get the hue state of lights of a bridge from its live states, else
+    from the bridge, a few lights are fetched one by one. None stands for
+    all lights. """
+    if live is not None and live.ready():
+        hue_lights = live.get(light_ids)
+        if hue_lights is not None:
+            return hue_lights
+    if light_ids is not None and len(light_ids) < SCOPED_FETCH_LIMIT:
+        return {
+            light_id: api.get(f'/lights/{light_id}')
+            for light_id in light_ids
+        }
+    return api.get('/lights')
+
+
+def in_parallel(function, calls):
+    """ Call `function` with the arguments of every call in its own thread
+    and return the results in order, a single call is made directly. """
+    if len(calls) < 2:
+        return [function(*args) for args in calls]
+    with ThreadPoolExecutor(max_workers=len(calls)) as executor:
+        return list(executor.map(lambda args: function(*args), calls))
+
+
+def get_states(db: Session, lights=None):
+    """ Get the hue state of the lights by their id, None stands for all
+    lights. The bridges are read at the same time, the lights of a bridge
+    that cannot be read are left out. """
+    bridges = crud.bridge.get_all(db)
+    by_bridge = {}
+    if lights is not None:
+        for light in lights:
+            by_bridge.setdefault(light.bridge_id, []).append(light)
+        bridges = [bridge for bridge in bridges if bridge.id in by_bridge]
+
+    # Only plain values are passed to the threads, the session of the
+    # database must not be used by them
+    calls = []
+    for bridge in bridges:
+        events.states.watch(bridge)
+        calls.append((
+            bridge.name,
+            api_from_bridge(bridge),
+            events.states.of(bridge.id),
+            None if lights is None else [
+                light.hue_id for light in by_bridge[bridge.id]
+            ]
+        ))
+
+    def read(name, api, live, light_ids):
+        try:
+            return get_light_states(api, live, light_ids)
+        except HTTPException as e:
+            log.error('reading the lights of %s failed: %s', name, e.detail)
+            return {}
+
+    hue_lights = {}
+    for bridge, bridge_lights in zip(bridges, in_parallel(read, calls)):
+        for light in by_bridge.get(bridge.id, bridge.lights):
+            if light.hue_id in bridge_lights:
+                hue_lights[light.id] = bridge_lights[light.hue_id]
+    return hue_lights
+
+
+_group_tables = {}
+
+
+def get_group_table(api):
+    """ The ids of the lights of every group on a bridge by the group id,
+    '0' holds all lights of the bridge. The table is read again after
+    `GROUPS_TTL` seconds, None if it cannot be read. """
+    now = dt.datetime.now()
+    cached = _group_tables.get(api.prefix_url)
+    if cached and now - cached[0] < dt.timedelta(seconds=GROUPS_TTL):
+        return cached[1]
+    try:
+        hue_groups = api.get('/groups')
+        hue_groups['0'] = api.get('/groups/0')
+    except HTTPException as e:
+        log.warning('reading the groups failed: %s', e.detail)
+        return None
+    table = {
+        group_id: frozenset(hue_group.get('lights', []))
+        for group_id, hue_group in hue_groups.items()
+    }
+    _group_tables[api.prefix_url] = (now, table)
+    return table
+
+
+def plan_commands(db: Session, bodies):
+    """ Plan the commands for the request bodies of the lights.
+
+    A bridge group or cluster whose lights all get the same body is
+    commanded with a single group action, all other lights with their own
+    command. A group is only used while its members on the bridge are
+    exactly these lights, the bridge may have changed it since the sync.
+    """
+    remaining = dict(bodies)
+
+    candidates = [
+        (bridge, '0', bridge.lights) for bridge in crud.bridge.get_all(db)
+    ] + [
+        (group.bridge, group.hue_id, group.lights)
+        for group in crud.group.get_all(db)
+    ] + [
+        (cluster.bridge, cluster.hue_id, cluster.lights)
+        for cluster in crud.cluster.get_all(db)
+    ]
+    candidates.sort(key=lambda candidate: len(candidate[2]), reverse=True)
+
+    commands = []
+    for bridge, group_id, lights in candidates:
+        if len(lights) < 2:
+            continue
+        if any(light.id not in remaining for light in lights):
+            continue
+        body = remaining[lights[0].id][1]
+        if any(remaining[light.id][1] != body for light in lights):
+            continue
+        api = api_from_bridge(bridge)
+        table = get_group_table(api) or {}
+        if table.get(group_id) != frozenset(
+            light.hue_id for light in lights
+        ):
+            continue
+        commands.append(group_command(api, group_id, lights, body))
+        for light in lights:
+            del remaining[light.id]
+
+    commands.extend(
+        light_command(api_from_bridge(light.bridge), light, body)
+        for light, body in remaining.values()
+    )
+    return commands
+
+
+def run(
+    disable=False,
+    lights=None,
+    db=None,
+    curves=None,
+    priority=False
+):
+    """ Calculate and execute the current state
+
+    If `curves` is given, only the lights that follow these curves are
+    updated, `lights` may hold them if they are already known. Commands of
+    runs with `priority` are sent before the ones of scheduled runs and
+    carry the current values at once. Commands of scheduled runs are spread
+    across the stagger window and fade across the transition window.
+
+    The bridges are read and commanded at the same time, each through its
+    own queue, the states are calculated in between.
+    """
+    if curves is not None:
+        if lights is None:
+            lights = get_affected_lights(db, curves)
+        if not lights:
+            log.debug('skipping run, no lights affected')
+            return
 
     status = crud.status.get(db)
     if status.status:
         settings = crud.settings.get(db)
 
-        hue_prev = api.get('/lights')
+        hue_prev = get_states(db, lights)
 
-        if not lights:
-            lights = crud.light.get_multi(db)
+        if lights is None:
+            lights = crud.light.get_all(db)
 
+        stagger = 0 if priority else settings.stagger_window
+        start = dt.datetime.now()
+        defaults = default_curves(db)
+        bodies = {}
         for light in lights:
-            prev_light_state = hue_prev.get(str(light.id)).get('state')
+            if light.id not in hue_prev:
+                continue
+            prev_light_state = hue_prev[light.id].get('state')
 
             if settings.smart_off:
                 light = crud.light.get_smart_off(light, prev_light_state)
@@ -88,8 +503,16 @@ def run(disable=False, lights=None, db=None, api=None):
             body = get_request_body(
                 db=db,
                 light=light,
-                prev_light_state=prev_light_state
+                prev_light_state=prev_light_state,
+                settings=settings,
+                now=start + dt.timedelta(seconds=phase(light, stagger)),
+                defaults=defaults,
+                immediate=priority
             )
+            if body:
+                body = drop_unchanged(light, body, prev_light_state)
+                if body == {}:
+                    cache.sent.count_saved()
 
             if body == {}:
                 log.debug(
@@ -97,49 +520,365 @@ def run(disable=False, lights=None, db=None, api=None):
                     light.id
                 )
             else:
-                response = api.put(
-                    f'/lights/{light.id}/state',
-                    json=body
-                )
-                log.debug('response: %s', response)
+                bodies[light.id] = (light, body)
+
+        commands = plan_commands(db, bodies)
+        for command in commands:
+            command.delay = min(
+                phase(light, stagger) for light in command.lights
+            )
+        report = dispatch(commands, priority=priority)
+        for command in report.commands:
+            log.debug('response: %s', command.response)
+            if command.error is not None or not command.done.is_set():
+                continue
+            applied = acknowledged(command.response)
+            complete = all(
+                attribute in applied for attribute in command.body
+                if attribute != 'transitiontime'
+            )
+            for light in command.lights:
+                cache.sent.record(light.id, command.body, applied)
+                live = events.states.of(light.bridge_id)
+                if live is not None:
+                    live.apply(light.hue_id, {
+                        attribute: value
+                        for attribute, value in applied.items()
+                        if attribute != 'transitiontime'
+                    })
                 if settings.smart_off:
-                    crud.light.reset_smart_off(db, api, light=light)
-                    # db.commit()
+                    # The baseline is the acknowledged state, a light is
+                    # only fetched again if the bridge did not apply all
+                    hue_state = None
+                    if complete:
+                        hue_state = dict(
+                            hue_prev[light.id].get('state'), **applied
+                        )
+                    crud.light.reset_smart_off(
+                        db, command.api, light=light, hue_state=hue_state
+                    )
 
     else:
         log.debug('disabled')
         if disable:
-            if not lights:
+            if lights is None:
                 lights = crud.light.get_multi_controlled(db)
+            elif curves is not None:
+                lights = [light for light in lights if light.on_controlled]
+
+            report = dispatch(
+                plan_commands(db, {
+                    light.id: (light, {'on': False}) for light in lights
+                }),
+                priority=priority
+            )
+            for command in report.commands:
+                log.debug(command.response)
+    log.debug('curve cache: %s', cache.curves.info())
+    log.debug('commands saved: %s', cache.sent.saved)
+    db.commit()
 
-            for light in lights:
-                response = api.put(
-                    f'/lights/{light.id}/state',
-                    json={'on': False}
-                )
-                log.debug(response)
-    crud.curve.calc_value.cache_clear()
+
+def plan_fingerprint(db: Session):
+    """ The config the plan of the day depends on. """
+    return (
+        tuple(
+            (
+                light.id, light.bri_curve_id, light.ct_curve_id,
+                light.bri_max, light.on_threshold, light.on,
+                light.bri_controlled, light.ct_controlled,
+                light.on_controlled
+            )
+            for light in crud.light.get_all(db)
+        ),
+        tuple(
+            (curve.id, curve.revision) for curve in crud.curve.get_all(db)
+        )
+    )
+
+
+def get_plan(db: Session) -> plan.DayPlan:
+    """ Get the plan of the day, it is built again after the config
+    changed. """
+    fingerprint = plan_fingerprint(db)
+    return cache.plans.get(fingerprint, lambda: build_plan(db, fingerprint))
+
+
+def build_plan(db: Session, fingerprint=None) -> plan.DayPlan:
+    """ Plan every change of the target state of the lights across the
+    day. """
+    day_plan = plan.DayPlan(fingerprint)
+    defaults = default_curves(db)
+
+    # Lights with identical curve shapes and settings share a plan
+    shared = {}
+    for light in crud.light.get_all(db):
+        bri_curve = curve_of(db, light, 'bri', defaults)
+        ct_curve = curve_of(db, light, 'ct', defaults)
+
+        signature = (
+            crud.curve.compile(bri_curve).key, bri_curve.offset,
+            crud.curve.compile(ct_curve).key, ct_curve.offset,
+            light.bri_max, light.on_threshold, light.bri_controlled,
+            light.ct_controlled, light.on_controlled and light.on
+        )
+        if signature not in shared:
+            shared[signature] = build_light_plan(
+                db, light, bri_curve, ct_curve, defaults
+            )
+        day_plan.add(light.id, shared[signature])
+    return day_plan
+
+
+def build_light_plan(db: Session, light, bri_curve, ct_curve, defaults=None):
+    """ Plan the changes of the target state of a light. """
+    switches = None
+    if light.on_controlled and light.on:
+        switches = calc_crossings(db, light, defaults)
+
+    def target(time):
+        minute = int(time)
+        return (
+            scale_brightness(light, crud.curve.value_at(bri_curve, minute))
+            if light.bri_controlled else plan.UNSET,
+            crud.curve.value_at(ct_curve, minute)
+            if light.ct_controlled else plan.UNSET,
+            int(switches.is_on(time)) if switches else plan.UNSET
+        )
+
+    light_plan = plan.LightPlan()
+    previous = target(0)
+    light_plan.add(0, *previous)
+    times = set(range(1, cache.MINUTES))
+    if switches:
+        times.update(switches.times)
+    for change in sorted(times):
+        current = target(change)
+        if current != previous:
+            light_plan.add(change, *current)
+            previous = current
+    return light_plan
+
+
+def next_change(db: Session, now: dt.datetime = None) -> dt.datetime:
+    """ Calculate the next time the target state of any light changes.
+
+    Brightness and color temperature change at full minutes, or at the end
+    of the transition window, the on state at the exact time the brightness
+    crosses the on threshold.
+    """
+    if now is None:
+        now = dt.datetime.now()
+    start = now.replace(second=0, microsecond=0)
+    minute = start.hour*60 + start.minute
+    day_start = start.replace(hour=0, minute=0)
+
+    steps = MAX_SLEEP
+    next_event = None
+    status = crud.status.get(db)
+    if status.status:
+        # Brightness and color temperature fade until the window ends
+        window = crud.settings.get(db).transition_window
+        if window:
+            steps = window - minute % window
+
+        # The bridges execute the plan themselves
+        if offload.active(crud.bridge.get_all(db)):
+            return start + dt.timedelta(minutes=MAX_SLEEP)
+
+        event = get_plan(db).next_event(
+            time_of_day(now), switches_only=bool(window)
+        )
+        if event is not None:
+            seconds = event*60
+            if seconds != math.floor(seconds):
+                # Fire on the first full second after the crossing
+                seconds = math.floor(seconds) + 1
+            next_event = day_start + dt.timedelta(seconds=seconds)
+
+    next_minute = start + dt.timedelta(minutes=steps)
+    if next_event is not None and next_event < next_minute:
+        return next_event
+    return next_minute
+
+
+def due_lights(db: Session, now: dt.datetime = None):
+    """ Get the lights with a planned change since the last scheduled run.
+
+    None stands for all lights, after a config change, with transitions and
+    at least every `MAX_SLEEP` minutes.
+    """
+    if now is None:
+        now = dt.datetime.now()
+    day_plan = get_plan(db)
+    due = day_plan.pop_due(time_of_day(now))
+
+    full_run = day_plan.full_run
+    if (
+        not due
+        or crud.settings.get(db).transition_window
+        or full_run is None
+        or now - full_run >= dt.timedelta(minutes=MAX_SLEEP)
+    ):
+        day_plan.full_run = now
+        return None
+    return [crud.light.get(db, id=light_id) for light_id in sorted(due)]
+
+
+def wake(db: Session):
+    """ Run the scheduled run early after a config change.
+
+    The scheduler runs in the master process while the endpoints run in
+    the workers, the change is passed on with the config revision.
+    """
+    status = crud.status.get(db)
+    status.revision += 1
     db.commit()
 
 
+def check_revision():
+    """ Start the scheduled run now if the config changed. """
+    db = SessionLocal()
+    try:
+        revision = crud.status.get(db).revision
+    finally:
+        db.close()
+    if revision == trigger.revision:
+        return
+    first = trigger.revision is None
+    trigger.revision = revision
+    if not first and trigger.job is not None:
+        try:
+            trigger.job.modify(
+                next_run_time=dt.datetime.now(trigger.timezone)
+            )
+        except JobLookupError:
+            pass
+
+
 def scheduled_run():
+    db = SessionLocal()
     try:
-        db = SessionLocal()
-        api = get_api(db)
-        run(db=db, api=api)
+        day_plan = get_plan(db)
+        lights = due_lights(db)
+
+        # Bridges that are unavailable or execute the plan themselves are
+        # left out of the run
+        skipped = set()
+        for bridge in crud.bridge.get_all(db):
+            if not api_from_bridge(bridge).breaker.closed:
+                log.warning('skipping run, %s is unavailable', bridge.name)
+                skipped.add(bridge.id)
+            elif offload.sync(db, bridge, day_plan):
+                run_offloaded(db, bridge)
+                skipped.add(bridge.id)
+
+        if skipped:
+            if lights is None:
+                lights = crud.light.get_all(db)
+            lights = [
+                light for light in lights if light.bridge_id not in skipped
+            ]
+        run(db=db, lights=lights)
+    except HTTPException as e:
+        log.error(e.detail)
+    finally:
+        db.close()
+
+
+def react(bridge_id, light_id):
+    """ Correct a light right after it was switched on, e.g. by a wall
+    switch, at a stale brightness. """
+    db = SessionLocal()
+    try:
+        light = crud.light.get_by_hue_id(db, bridge_id, light_id)
+        if light is None or not (light.bri_controlled or light.ct_controlled):
+            return
+        if not crud.status.get(db).status:
+            return
+        if crud.settings.get(db).smart_off:
+            # Switching on a light that ambientHUE switched off is a
+            # Smart Off, the stale values of a light that was on are not
+            if light.on_controlled and light.smart_off_on is False:
+                return
+            live = events.states.of(bridge_id)
+            hue_lights = live.get([light.hue_id]) if live else None
+            crud.light.reset_smart_off(
+                db, api_from_bridge(light.bridge), light=light,
+                hue_state=(hue_lights or {}).get(light.hue_id, {}).get(
+                    'state'
+                )
+            )
+        log.debug('light %s switched on', light.id)
+        run(lights=[light], db=db, priority=True)
+    except HTTPException as e:
+        log.error(e.detail)
+    finally:
+        db.close()
+
+
+_checks = set()
+_checks_lock = Lock()
+
+
+def react_change(bridge_id, light_id):
+    """ Check a bridge that executes the plan for Smart Off right after the
+    state of one of its lights changed, before the next schedule
+    overwrites a change by hand. """
+    if not offload.state_of(bridge_id).active:
+        return
+    with _checks_lock:
+        if bridge_id in _checks:
+            return
+        _checks.add(bridge_id)
+    sleep(SMART_OFF_SETTLE)
+    with _checks_lock:
+        _checks.discard(bridge_id)
+
+    db = SessionLocal()
+    try:
+        bridge = crud.bridge.get(db, bridge_id)
+        if bridge is not None:
+            run_offloaded(db, bridge)
     except HTTPException as e:
         log.error(e.detail)
+    finally:
+        db.close()
+
+
+def run_offloaded(db: Session, bridge):
+    """ Watch for Smart Off while a bridge executes the plan. """
+    if crud.settings.get(db).smart_off:
+        offload.check_smart_off(
+            db, bridge, time_of_day(dt.datetime.now())*60,
+            get_light_states(
+                api_from_bridge(bridge), events.states.of(bridge.id)
+            )
+        )
 
 
 def scheduled_daily_cleanup():
     reset_offsets()
     reset_smart_off()
+    build_daily_plan()
+
+
+def build_daily_plan():
+    db = SessionLocal()
+    day_plan = get_plan(db)
+    log.info('Planned %s commands for the day', day_plan.commands())
+    for bridge in crud.bridge.get_all(db):
+        try:
+            offload.sync(db, bridge, day_plan)
+        except HTTPException as e:
+            log.error(e.detail)
+    db.close()
 
 
 def reset_offsets():
     db = SessionLocal()
 
-    curves = crud.curve.get_multi(db)
+    curves = crud.curve.get_all(db)
     for curve in curves:
         try:
             crud.curve.update(db, db_obj=curve, obj_in={
@@ -153,23 +892,28 @@ def reset_offsets():
 
 def reset_smart_off():
     db = SessionLocal()
-    api = get_api(db)
-    lights = crud.light.get_multi(db)
-    for light in lights:
+    count = 0
+    for bridge in crud.bridge.get_all(db):
+        api = api_from_bridge(bridge)
         try:
-            crud.light.reset_smart_off(db, api, light=light)
+            hue_lights = api.get('/lights')
+            for light in bridge.lights:
+                crud.light.reset_smart_off(
+                    db, api, light=light,
+                    hue_state=hue_lights.get(light.hue_id, {}).get('state')
+                )
+                count += 1
         except HTTPException as e:
             log.error(e.detail)
     db.commit()
-    log.info('Reset smart off for %s lights', len(lights))
+    log.info('Reset smart off for %s lights', count)
     db.close()
 
 
 def scheduled_sync():
     try:
         db = SessionLocal()
-        api = get_api(db)
-        log.info(crud.bridge.sync(db, api))
+        log.info(crud.bridge.sync_all(db))
     except HTTPException as e:
         log.error(e.detail)
 
@@ -1,5 +1,5 @@
 from typing import List, Optional
-from pydantic import BaseModel, IPvAnyAddress, SecretStr
+from pydantic import BaseModel, IPvAnyAddress, SecretStr, confloat, conint
 
 
 class PointBase(BaseModel):
@@ -11,6 +11,12 @@ class PointUpdate(PointBase):
     pass
 
 
+class PointPatch(BaseModel):
+    index: int
+    x: Optional[int]
+    y: Optional[int]
+
+
 class PointCreate(BaseModel):
     position: str
 
@@ -49,6 +55,26 @@ class Curve(CurveBase):
         orm_mode = True
 
 
+class CurveImportPoint(BaseModel):
+    x: float
+    y: float
+
+
+class CurveImport(CurveBase):
+    offset: float = 0
+    tolerance: confloat(ge=0) = 1
+    points: Optional[List[CurveImportPoint]]
+    csv: Optional[str]
+
+
+class CurveSamples(BaseModel):
+    id: int
+    kind: str
+    revision: str
+    step: int
+    values: List[int]
+
+
 class HeaderBase(BaseModel):
     name: str
     value: str
@@ -113,6 +139,14 @@ class Status(StatusBase):
 
 class SettingsBase(BaseModel):
     smart_off: bool
+    dynamic_groups: bool = False
+    bri_deadband: conint(ge=0) = 0
+    ct_deadband: conint(ge=0) = 0
+    max_staleness: conint(ge=0) = 15
+    transition_window: conint(ge=0, le=60) = 0
+    stagger_window: conint(ge=0, le=59) = 0
+    bridge_schedules: bool = False
+    schedule_resolution: conint(ge=1, le=100) = 15
 
 
 class SettingsUpdate(SettingsBase):
@@ -132,6 +166,8 @@ class Settings(SettingsBase):
 
 class LightBase(BaseModel):
     id: int
+    bridge_id: Optional[str]
+    hue_id: Optional[str]
     name: str
     type: str
     modelid: str
@@ -186,7 +222,8 @@ class GroubBase(BaseModel):
 
 
 class GroupCreate(GroubBase):
-    id: int
+    bridge_id: str
+    hue_id: str
 
 
 class GroupUpdate(GroubBase):
@@ -195,6 +232,7 @@ class GroupUpdate(GroubBase):
 
 class GroupInfo(BaseModel):
     id: int
+    bridge_id: Optional[str]
     name: str
     type: str
     lights: List[LightInfo]
@@ -205,6 +243,7 @@ class GroupInfo(BaseModel):
 
 class Group(BaseModel):
     id: int
+    bridge_id: Optional[str]
     name: str
     type: str
     lights: List[Light]
@@ -213,6 +252,37 @@ class Group(BaseModel):
         orm_mode = True
 
 
+class ClusterBase(BaseModel):
+    key: str
+
+
+class ClusterCreate(ClusterBase):
+    bridge_id: str
+    hue_id: str
+
+
+class ClusterUpdate(ClusterBase):
+    pass
+
+
+class PlanEvent(BaseModel):
+    time: float
+    bri: Optional[int]
+    ct: Optional[int]
+    on: Optional[bool]
+
+
+class LightPlan(BaseModel):
+    id: int
+    commands: int
+    events: Optional[List[PlanEvent]]
+
+
+class Plan(BaseModel):
+    commands: int
+    lights: List[LightPlan]
+
+
 class PositionBase(BaseModel):
     position: int
     visible: bool
@@ -262,6 +332,7 @@ class BridgeDiscovery(BaseModel):
 class BridgeSync(BaseModel):
     lights: int
     groups: int
+    clusters: int = 0
 
 
 class Bridge(BridgeBase):